@@ -1,3 +1,25 @@
+from django.contrib.auth.models import User
 from django.test import TestCase
+from django.urls import reverse
 
-# Create your tests here.
+from .models import Article, Author, Category, Tag
+
+
+class ArticleListViewTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='blog_reader', password='qwerty')
+        tags = Tag.objects.bulk_create([Tag(name=f'tag{i}') for i in range(3)])
+        for i in range(10):
+            article = Article.objects.create(
+                title=f'Article {i}',
+                author=Author.objects.create(name=f'Author {i}'),
+                category=Category.objects.create(name=f'Category {i}'),
+            )
+            article.tags.set(tags)
+
+    def test_articles_list_within_query_budget(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('blogapp:articles_list'))
+        self.assertContains(response, 'Author 9')
+        self.assertContains(response, 'tag2', count=10)
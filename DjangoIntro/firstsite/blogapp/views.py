@@ -2,9 +2,12 @@ from django.shortcuts import render
 from django.views.generic import ListView
 
 from blogapp.models import Article
+from requestdaapp.query_budget import QueryBudgetMixin
 
 # Create your views here.
-class ArticleListView(ListView):
+class ArticleListView(QueryBudgetMixin, ListView):
+    # session, user, articles with authors and categories, tags
+    query_budget = 4
     template_name = 'blogapp/article_list.html'
     context_object_name = 'article_list'
     queryset = (Article.objects
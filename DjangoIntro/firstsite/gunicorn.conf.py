@@ -0,0 +1,37 @@
+"""
+Gunicorn settings.
+
+GUNICORN_MODE=wsgi (default) runs sync workers on firstsite.wsgi,
+GUNICORN_MODE=asgi runs uvicorn workers on firstsite.asgi, so async views
+and middlewares are served without a thread hop per request.
+The workers' metrics dumps in METRICS_DIR are reset on start and merged
+when a worker exits (requestdaapp.metrics).
+"""
+from multiprocessing import cpu_count
+from os import environ, getenv
+
+bind = getenv('GUNICORN_BIND') or '0.0.0.0:8000'
+workers = int(getenv('GUNICORN_WORKERS') or cpu_count() * 2 + 1)
+
+if getenv('GUNICORN_MODE') == 'asgi':
+    wsgi_app = 'firstsite.asgi:application'
+    worker_class = 'uvicorn_worker.UvicornWorker'
+else:
+    wsgi_app = 'firstsite.wsgi:application'
+    worker_class = 'sync'
+
+
+def _metrics_dir() -> str:
+    environ.setdefault('DJANGO_SETTINGS_MODULE', 'firstsite.settings')
+    from django.conf import settings
+    return settings.METRICS_DIR
+
+
+def on_starting(server):
+    from requestdaapp.metrics import clear_directory
+    clear_directory(_metrics_dir())
+
+
+def child_exit(server, worker):
+    from requestdaapp.metrics import mark_process_dead
+    mark_process_dead(_metrics_dir(), worker.pid)
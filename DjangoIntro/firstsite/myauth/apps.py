@@ -4,3 +4,10 @@ from django.apps import AppConfig
 class MyauthConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'myauth'
+
+    def ready(self):
+        from django.db.models.signals import post_migrate
+
+        from . import signals  # noqa: F401
+        # permissions created by migrate come from bulk_create, without post_save
+        post_migrate.connect(signals.invalidate_all_permissions, sender=self)
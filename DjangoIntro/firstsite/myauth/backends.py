@@ -0,0 +1,25 @@
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import cache
+
+from .permissions import PERMISSIONS_CACHE_TIMEOUT, permissions_cache_key
+
+
+class CachedPermissionsBackend(ModelBackend):
+    """
+    ModelBackend keeping each user's resolved permission set in the cache,
+    so has_perm() and {{ perms }} stop querying the user and group
+    permissions on every request. The key carries the permissions version
+    that the myauth signals bump on every change of the m2m relations.
+    """
+
+    def get_all_permissions(self, user_obj, obj=None):
+        if not user_obj.is_active or user_obj.is_anonymous or obj is not None:
+            return set()
+        if not hasattr(user_obj, '_perm_cache'):
+            key = permissions_cache_key(user_obj)
+            permissions = cache.get(key)
+            if permissions is None:
+                permissions = super().get_all_permissions(user_obj)
+                cache.set(key, permissions, PERMISSIONS_CACHE_TIMEOUT)
+            user_obj._perm_cache = permissions
+        return user_obj._perm_cache
@@ -0,0 +1,26 @@
+from django.http import HttpRequest
+from django.utils.functional import SimpleLazyObject
+
+from .permissions import get_permissions_version
+
+
+class PermissionSet(frozenset):
+    version = ''
+
+
+def _user_permissions(user) -> PermissionSet:
+    if user is None or not user.is_authenticated:
+        return PermissionSet()
+    permissions = PermissionSet(user.get_all_permissions())
+    permissions.version = get_permissions_version(user.pk)
+    return permissions
+
+
+def permissions(request: HttpRequest) -> dict:
+    """
+    user_perms: the permission names of the user as a set, for
+    {% if 'app.codename' in user_perms %}; user_perms.version belongs in the
+    keys of fragments that depend on them. Resolved on first use.
+    """
+    user = getattr(request, 'user', None)
+    return {'user_perms': SimpleLazyObject(lambda: _user_permissions(user))}
@@ -0,0 +1,31 @@
+from django.core.management import BaseCommand
+from PIL import Image
+
+from myauth.models import Profile
+from myauth.thumbnails import THUMBNAIL_FORMATS, THUMBNAIL_SIZES, ensure_thumbnail, file_digest
+
+
+class Command(BaseCommand):
+    help = (
+        'Render the avatar thumbnails ahead of their first request, '
+        'hashing the avatars uploaded before thumbnails existed'
+    )
+
+    def handle(self, *args, **options):
+        rendered = 0
+        for profile in Profile.objects.exclude(avatar='').exclude(avatar=None).only('avatar', 'avatar_hash').iterator():
+            try:
+                with profile.avatar.open('rb') as source:
+                    if not profile.avatar_hash:
+                        profile.avatar_hash = file_digest(source)
+                        Profile.objects.filter(pk=profile.pk).update(avatar_hash=profile.avatar_hash)
+                    for size in THUMBNAIL_SIZES:
+                        for fmt in THUMBNAIL_FORMATS:
+                            ensure_thumbnail(profile.avatar_hash, size, fmt, source)
+                            source.seek(0)
+            # OSError covers a missing, unidentified or truncated file
+            except (OSError, Image.DecompressionBombError) as exc:
+                self.stderr.write(f'Profile #{profile.pk}: {exc}')
+                continue
+            rendered += 1
+        self.stdout.write(self.style.SUCCESS(f'Thumbnails ready for {rendered} avatars'))
@@ -1,14 +1,62 @@
 from django.contrib.auth.models import User
 from django.db import models
+from django.urls import reverse
+from django.utils.functional import cached_property
+
+from .thumbnails import THUMBNAIL_FORMATS, THUMBNAIL_SIZES, file_digest
 
 def avatar_directory_path(instance: 'Profile', filename: str) -> str:
-    return 'profile/profile_{pk}/preview/{filename}'.format(
-        pk=instance.pk,
+    # the profile has no pk before its first save, the user always has one
+    return 'profile/profile_{user_id}/preview/{filename}'.format(
+        user_id=instance.user_id,
         filename=filename,
     )
 
+class ProfileQuerySet(models.QuerySet):
+    def username_prefix(self, prefix: str) -> 'ProfileQuerySet':
+        """
+        Profiles whose username starts with the prefix (case-sensitive). The
+        range on username lets the unique index of auth_user seek to the
+        prefix; startswith keeps the result exact whatever the collation.
+        """
+        upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        return self.filter(
+            user__username__gte=prefix, user__username__lt=upper, user__username__startswith=prefix,
+        )
+
+
 class Profile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     bio = models.TextField(max_length=500, blank=True)
     agreement_accepted = models.BooleanField(default=False)
-    avatar = models.ImageField(null=True, blank=True, upload_to=avatar_directory_path)
\ No newline at end of file
+    avatar = models.ImageField(null=True, blank=True, upload_to=avatar_directory_path)
+    # sha256 of the avatar file, the key of its thumbnails
+    avatar_hash = models.CharField(max_length=64, blank=True, editable=False, db_index=True)
+
+    objects = ProfileQuerySet.as_manager()
+
+    def save(self, *args, **kwargs):
+        if not self.avatar:
+            self.avatar_hash = ''
+        elif not self.avatar._committed:
+            self.avatar_hash = file_digest(self.avatar)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'avatar' in update_fields:
+            kwargs['update_fields'] = {*update_fields, 'avatar_hash'}
+        super().save(*args, **kwargs)
+
+    @cached_property
+    def avatar_thumbnails(self) -> dict:
+        """Thumbnail urls by size and format plus the edge in pixels, empty until the avatar is hashed."""
+        if not self.avatar_hash:
+            return {}
+        return {
+            size: {
+                'px': edge,
+                **{
+                    fmt: reverse('myauth:avatar-thumbnail', kwargs={'digest': self.avatar_hash, 'size': size, 'fmt': fmt})
+                    for fmt in THUMBNAIL_FORMATS
+                },
+            }
+            for size, edge in THUMBNAIL_SIZES.items()
+        }
\ No newline at end of file
@@ -0,0 +1,38 @@
+from django.core.cache import cache
+
+# bumped when a change may touch many users: group permissions, new or deleted permissions
+PERMISSIONS_VERSION_KEY = 'permissions_version'
+PERMISSIONS_CACHE_TIMEOUT = 60 * 60
+
+
+def user_permissions_version_key(user_id: int) -> str:
+    return f'user_{user_id}_permissions_version'
+
+
+def get_permissions_version(user_id: int) -> str:
+    """Version of the user's permission set, changed by any write that can alter it."""
+    keys = [PERMISSIONS_VERSION_KEY, user_permissions_version_key(user_id)]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, 1, None)
+            versions[key] = cache.get(key, 1)
+    return '.'.join(str(versions[key]) for key in keys)
+
+
+def bump_permissions_version(user_id: int | None = None) -> None:
+    """Retire the cached permissions of one user, or of everybody without a user_id."""
+    key = PERMISSIONS_VERSION_KEY if user_id is None else user_permissions_version_key(user_id)
+    cache.add(key, 1, None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # the key was culled between add() and incr()
+        cache.set(key, 2, None)
+
+
+def permissions_cache_key(user) -> str:
+    # superusers get every permission, so the flag is part of the key rather than a reason to invalidate;
+    # date_joined tells apart users getting the id of a rolled back one
+    joined = int(user.date_joined.timestamp() * 10 ** 6)
+    return f'user_{user.pk}_{joined}_permissions_{int(user.is_superuser)}_v{get_permissions_version(user.pk)}'
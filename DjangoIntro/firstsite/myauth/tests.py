@@ -1,3 +1,186 @@
-from django.test import TestCase
+import hashlib
+from io import BytesIO, StringIO
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest.mock import patch
+
+from django.contrib.auth.models import Group, Permission, User
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.template import RequestContext, Template
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import reverse
+from PIL import Image
+
+from .models import Profile
+from .thumbnails import thumbnail_name
 
 # Create your tests here.
+
+
+def make_image(size=(800, 600), fmt='PNG') -> bytes:
+    buffer = BytesIO()
+    Image.new('RGB', size, (200, 30, 30)).save(buffer, fmt)
+    return buffer.getvalue()
+
+
+class AvatarThumbnailTestCase(TestCase):
+    def setUp(self):
+        media = TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.media = Path(media.name)
+        media_settings = override_settings(MEDIA_ROOT=media.name)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+        self.user = User.objects.create_user(username='avatar_owner')
+        self.image = make_image()
+        self.profile = Profile.objects.create(user=self.user, avatar=SimpleUploadedFile('me.png', self.image))
+
+    def test_avatar_path_and_hash(self):
+        self.assertEqual(self.profile.avatar.name, f'profile/profile_{self.user.pk}/preview/me.png')
+        self.assertEqual(self.profile.avatar_hash, hashlib.sha256(self.image).hexdigest())
+
+        self.profile.avatar = None
+        self.profile.save(update_fields=['avatar'])
+        self.profile.refresh_from_db()
+        self.assertEqual(self.profile.avatar_hash, '')
+
+    def test_thumbnail_rendered_on_first_access_and_cached(self):
+        url = self.profile.avatar_thumbnails['medium']['webp']
+
+        response = self.client.get(url)
+        self.assertEqual(response['Content-Type'], 'image/webp')
+        self.assertIn('immutable', response['Cache-Control'])
+        with Image.open(BytesIO(b''.join(response.streaming_content))) as thumbnail:
+            self.assertEqual((thumbnail.format, thumbnail.size), ('WEBP', (150, 150)))
+        self.assertTrue((self.media / thumbnail_name(self.profile.avatar_hash, 'medium', 'webp')).exists())
+
+        # served from disk without looking up the profile
+        with self.assertNumQueries(0):
+            response = self.client.get(url, headers={'If-None-Match': response['ETag']})
+        self.assertEqual(response.status_code, 304)
+
+    def test_unknown_thumbnail(self):
+        url = reverse('myauth:avatar-thumbnail', kwargs={'digest': '0' * 64, 'size': 'medium', 'fmt': 'webp'})
+        self.assertEqual(self.client.get(url).status_code, 404)
+        url = reverse('myauth:avatar-thumbnail', kwargs={'digest': self.profile.avatar_hash, 'size': 'huge', 'fmt': 'webp'})
+        self.assertEqual(self.client.get(url).status_code, 404)
+        for digest in ('..', self.profile.avatar_hash.upper(), self.profile.avatar_hash[:63]):
+            url = reverse('myauth:avatar-thumbnail', kwargs={'digest': digest, 'size': 'medium', 'fmt': 'webp'})
+            self.assertEqual(self.client.get(url).status_code, 404, digest)
+
+    def test_decompression_bomb_is_not_rendered(self):
+        url = self.profile.avatar_thumbnails['medium']['webp']
+        with patch.object(Image, 'MAX_IMAGE_PIXELS', 1000):
+            response = self.client.get(url)
+
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse((self.media / thumbnail_name(self.profile.avatar_hash, 'medium', 'webp')).exists())
+
+    def test_truncated_avatar_is_not_rendered(self):
+        (self.media / self.profile.avatar.name).write_bytes(self.image[:len(self.image) // 2])
+
+        response = self.client.get(self.profile.avatar_thumbnails['medium']['webp'])
+        self.assertEqual(response.status_code, 404)
+
+        stderr = StringIO()
+        call_command('makethumbnails', stdout=StringIO(), stderr=stderr)
+        self.assertIn(f'Profile #{self.profile.pk}', stderr.getvalue())
+
+    def test_pages_link_thumbnails(self):
+        thumbnails = self.profile.avatar_thumbnails
+
+        self.assertContains(self.client.get(reverse('myauth:user-details', kwargs={'pk': self.profile.pk})), thumbnails['medium']['webp'])
+        self.assertContains(self.client.get(reverse('myauth:users-profile')), thumbnails['small']['jpeg'])
+
+    def test_makethumbnails_hashes_old_avatars(self):
+        Profile.objects.filter(pk=self.profile.pk).update(avatar_hash='')
+
+        call_command('makethumbnails', stdout=StringIO())
+        self.profile.refresh_from_db()
+
+        self.assertEqual(self.profile.avatar_hash, hashlib.sha256(self.image).hexdigest())
+        self.assertEqual(len(list((self.media / 'thumbnails').rglob('*.*'))), 4)
+
+
+class UsersProfileTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        users = User.objects.bulk_create([User(username=f'member{i:03}') for i in range(120)])
+        Profile.objects.bulk_create([Profile(user=user) for user in users])
+        cls.viewer = User.objects.create_user(username='viewer')
+
+    def setUp(self):
+        self.client.force_login(self.viewer)
+
+    def get_usernames(self, response) -> list[str]:
+        return [profile.user.username for profile in response.context['profiles']]
+
+    def test_pages_follow_username_order(self):
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse('myauth:users-profile'))
+        self.assertEqual(self.get_usernames(response), [f'member{i:03}' for i in range(50)])
+
+        response = self.client.get(reverse('myauth:users-profile'), {'cursor': response.context['page'].next_cursor})
+        self.assertEqual(self.get_usernames(response)[0], 'member050')
+        self.assertIsNotNone(response.context['page'].previous_cursor)
+
+    def test_username_prefix_search(self):
+        response = self.client.get(reverse('myauth:users-profile'), {'q': 'member11'})
+
+        self.assertEqual(self.get_usernames(response), [f'member11{i}' for i in range(10)])
+        self.assertIsNone(response.context['page'].next_cursor)
+        self.assertEqual(list(Profile.objects.username_prefix('Member')), [])
+
+
+class CachedPermissionsTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.add_product = Permission.objects.get(codename='add_product')
+        cls.change_product = Permission.objects.get(codename='change_product')
+        cls.group = Group.objects.create(name='catalog editors')
+        cls.group.permissions.add(cls.add_product)
+        cls.user = User.objects.create_user(username='editor')
+        cls.user.groups.add(cls.group)
+
+    def setUp(self):
+        # the cached versions outlive the rollback of the previous test
+        cache.clear()
+
+    def fresh_user(self) -> User:
+        # what the next request gets: a new user object without the per-instance cache
+        return User.objects.get(pk=self.user.pk)
+
+    def test_permission_set_cached_between_requests(self):
+        self.assertTrue(self.fresh_user().has_perm('shopapp.add_product'))
+
+        user = self.fresh_user()
+        with self.assertNumQueries(0):
+            self.assertTrue(user.has_perm('shopapp.add_product'))
+            self.assertFalse(user.has_perm('shopapp.change_product'))
+
+    def test_m2m_changes_invalidate(self):
+        self.assertFalse(self.fresh_user().has_perm('shopapp.change_product'))
+
+        self.user.user_permissions.add(self.change_product)
+        self.assertTrue(self.fresh_user().has_perm('shopapp.change_product'))
+
+        self.change_product.user_set.remove(self.user)
+        self.assertFalse(self.fresh_user().has_perm('shopapp.change_product'))
+
+        self.group.permissions.add(self.change_product)
+        self.assertTrue(self.fresh_user().has_perm('shopapp.change_product'))
+
+        self.group.user_set.remove(self.user)
+        self.assertEqual(self.fresh_user().get_all_permissions(), set())
+
+    def test_user_perms_in_templates(self):
+        request = RequestFactory().get('/')
+        request.user = self.fresh_user()
+        template = Template("{% if 'shopapp.add_product' in user_perms %}add{% endif %} {{ user_perms.version }}")
+
+        rendered = template.render(RequestContext(request))
+
+        self.assertTrue(rendered.startswith('add '))
+        self.assertRegex(rendered, r'\d+\.\d+$')
@@ -0,0 +1,58 @@
+import hashlib
+from io import BytesIO
+
+from django.core.files import File
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+
+# square avatar thumbnails by name: the edge in pixels
+THUMBNAIL_SIZES = {
+    'small': 48,
+    'medium': 150,
+}
+# format in the url: Pillow format, content type and save options
+THUMBNAIL_FORMATS = {
+    'webp': ('WEBP', 'image/webp', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', 'image/jpeg', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+# the path holds the hash of the original, so a thumbnail never changes once written
+THUMBNAIL_MAX_AGE = 365 * 24 * 60 * 60
+
+
+def file_digest(file: File) -> str:
+    sha256 = hashlib.sha256()
+    file.seek(0)
+    for chunk in file.chunks():
+        sha256.update(chunk)
+    file.seek(0)
+    return sha256.hexdigest()
+
+
+def thumbnail_name(digest: str, size: str, fmt: str) -> str:
+    return f'thumbnails/avatars/{digest[:2]}/{digest}/{size}.{fmt}'
+
+
+def render_thumbnail(source: File, size: str, fmt: str) -> bytes:
+    edge = THUMBNAIL_SIZES[size]
+    pillow_format, _, options = THUMBNAIL_FORMATS[fmt]
+    with Image.open(source) as image:
+        # lets the JPEG decoder scale down while decoding instead of inflating the full image
+        image.draft('RGB', (edge * 2, edge * 2))
+        image = ImageOps.exif_transpose(image).convert('RGB')
+        image = ImageOps.fit(image, (edge, edge), Image.Resampling.LANCZOS)
+        buffer = BytesIO()
+        image.save(buffer, pillow_format, **options)
+    return buffer.getvalue()
+
+
+def ensure_thumbnail(digest: str, size: str, fmt: str, source: File) -> str:
+    """Write the thumbnail unless it is on disk already; returns its storage name."""
+    name = thumbnail_name(digest, size, fmt)
+    if default_storage.exists(name):
+        return name
+    saved = default_storage.save(name, ContentFile(render_thumbnail(source, size, fmt)))
+    if saved != name:
+        # another request wrote the same thumbnail meanwhile
+        default_storage.delete(saved)
+    return name
@@ -3,7 +3,7 @@ from django.urls import path
 from werkzeug.utils import redirect
 
 from .views import get_cookie_view, set_cookie_view, set_session_view, get_session_view, MyLogoutView, AboutMeView, \
-    RegisterView, logout_view, UsersProfile, UserDetailView, UserUpdateView, ProfileUpdateView
+    RegisterView, logout_view, UsersProfile, UserDetailView, UserUpdateView, ProfileUpdateView, avatar_thumbnail_view
 
 app_name = 'myauth'
 
@@ -20,6 +20,7 @@ urlpatterns = [
     path('user/<int:pk>/', UserDetailView.as_view(), name='user-details'),
     path('user/<int:pk>/update/', UserUpdateView.as_view(), name='user-update'),
     path('profile/<int:pk>/update/', ProfileUpdateView.as_view(), name='profile-update'),
+    path('avatars/<str:digest>/<slug:size>.<slug:fmt>', avatar_thumbnail_view, name='avatar-thumbnail'),
 
     path('cookie/get', get_cookie_view, name='cookie-get'),
     path('cookie/set', set_cookie_view, name='cookie-set'),
@@ -1,3 +1,4 @@
+import re
 from http.client import responses
 
 from django.contrib.auth import authenticate, login, logout
@@ -6,12 +7,19 @@ from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth.mixins import PermissionRequiredMixin
 from django.contrib.auth.models import User
 from django.contrib.auth.views import LogoutView
-from django.http import HttpRequest, HttpResponse
+from django.core.files.storage import default_storage
+from django.http import FileResponse, Http404, HttpRequest, HttpResponse
 from django.shortcuts import render, redirect, get_object_or_404
 from django.urls import reverse, reverse_lazy
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import condition
 from django.views.generic import TemplateView, CreateView, UpdateView, ListView, DetailView
+from PIL import Image
 
+from requestdaapp.query_budget import QueryBudgetMixin
+from shopapp.pagination import KeysetPaginator
 from .models import Profile
+from .thumbnails import THUMBNAIL_FORMATS, THUMBNAIL_MAX_AGE, THUMBNAIL_SIZES, ensure_thumbnail, thumbnail_name
 
 class AboutMeView(UpdateView):
     model = Profile
@@ -49,14 +57,29 @@ def logout_view(request: HttpRequest):
 class MyLogoutView(LogoutView):
     next_page = reverse_lazy('myauth:login')
 
-class UsersProfile(ListView):
-    model = Profile
+class UsersProfile(QueryBudgetMixin, ListView):
     template_name = 'myauth/users-profile.html'
     context_object_name = 'profiles'
+    query_budget = 4
+    page_size = 50
+    # the unique index on username serves both the ordering and the keyset seek
+    page_ordering = ('user__username', 'pk')
+
+    def get_queryset(self):
+        queryset = Profile.objects.select_related('user').only('user__username', 'avatar', 'avatar_hash')
+        self.search = self.request.GET.get('q', '').strip()
+        if self.search:
+            queryset = queryset.username_prefix(self.search)
+        return queryset
+
+    def get_context_data(self, **kwargs):
+        paginator = KeysetPaginator(self.object_list, self.page_ordering, self.page_size)
+        page = paginator.page(self.request.GET.get('cursor'))
+        return super().get_context_data(object_list=page.object_list, page=page, search=self.search, **kwargs)
 
 class UserDetailView(DetailView):
     template_name = 'myauth/user-details.html'
-    model = Profile
+    queryset = Profile.objects.select_related('user')
     context_object_name = 'profile'
 
 class UserUpdateView(UpdateView):
@@ -99,4 +122,25 @@ def set_session_view(request: HttpRequest) -> HttpResponse:
 @login_required
 def get_session_view(request: HttpRequest) -> HttpResponse:
     value = request.session.get('foobar', 'default')
-    return HttpResponse(f'Session value: {value!r}')
\ No newline at end of file
+    return HttpResponse(f'Session value: {value!r}')
+
+
+@condition(etag_func=lambda request, digest, size, fmt: f'{digest}-{size}-{fmt}')
+def avatar_thumbnail_view(request: HttpRequest, digest: str, size: str, fmt: str) -> HttpResponse:
+    """Serves an avatar thumbnail, rendering it on first access."""
+    if not re.fullmatch(r'[0-9a-f]{64}', digest) or size not in THUMBNAIL_SIZES or fmt not in THUMBNAIL_FORMATS:
+        raise Http404
+    name = thumbnail_name(digest, size, fmt)
+    if not default_storage.exists(name):
+        profile = Profile.objects.filter(avatar_hash=digest).exclude(avatar='').only('avatar').first()
+        if profile is None:
+            raise Http404
+        try:
+            with profile.avatar.open('rb') as source:
+                ensure_thumbnail(digest, size, fmt, source)
+        # OSError covers a missing, unidentified or truncated file
+        except (OSError, Image.DecompressionBombError):
+            raise Http404
+    response = FileResponse(default_storage.open(name, 'rb'), content_type=THUMBNAIL_FORMATS[fmt][1])
+    patch_cache_control(response, public=True, max_age=THUMBNAIL_MAX_AGE, immutable=True)
+    return response
@@ -1,6 +1,6 @@
 from django import forms
-from django.core.files.uploadedfile import InMemoryUploadedFile
-from pydantic import ValidationError
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import UploadedFile
 
 
 class UserBioForm(forms.Form):
@@ -8,7 +8,7 @@ class UserBioForm(forms.Form):
     age = forms.IntegerField(label='Your age', min_value=1,max_value=100)
     bio = forms.CharField(label='Biography')
 
-def validate_file_name(file: InMemoryUploadedFile) -> None:
+def validate_file_name(file: UploadedFile) -> None:
     if file.name and 'virus' in file.name:
         raise ValidationError('file name should not contain "virus"')
 
@@ -0,0 +1,14 @@
+from django.core.management import BaseCommand
+
+from requestdaapp.uploads import remove_stale_partials
+
+
+class Command(BaseCommand):
+    help = 'Delete the partial files of abandoned uploads'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than', type=float, default=24.0, help='hours since the last received chunk')
+
+    def handle(self, *args, **options):
+        removed = remove_stale_partials(options['older_than'] * 60 * 60)
+        self.stdout.write(self.style.SUCCESS(f'Removed {removed} partial upload files'))
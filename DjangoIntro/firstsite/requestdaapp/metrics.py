@@ -0,0 +1,231 @@
+import atexit
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from pathlib import Path
+
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class _ThreadStore:
+    def __init__(self):
+        self.counters = defaultdict(int)
+        # histogram value: per-bucket counts, the +Inf bucket, then the sum
+        self.histograms = {}
+
+
+class MetricsRegistry:
+    """
+    Request metrics kept in per-thread stores, so recording never takes a lock.
+    With a directory configured every process periodically dumps its totals to
+    metrics-<pid>.json from a background thread, and collect() merges the
+    files of all workers. flush_interval=None leaves flushing to the caller.
+    The files outlive their processes: the server empties the directory when
+    it starts and folds a dead worker's file into metrics-exited.json, see
+    clear_directory() and mark_process_dead().
+    """
+
+    def __init__(self, directory: str | None = None, flush_interval: float | None = 5.0):
+        self.directory = Path(directory) if directory else None
+        self.flush_interval = flush_interval
+        self._reset()
+        os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._stores = []
+        self._flusher_pid = None
+
+    def _store(self) -> _ThreadStore:
+        store = getattr(self._local, 'store', None)
+        if store is None:
+            store = self._local.store = _ThreadStore()
+            with self._lock:
+                self._stores.append(store)
+            self._start_flusher()
+        return store
+
+    def inc(self, name: str, labels: tuple = (), value: int = 1) -> None:
+        self._store().counters[(name, labels)] += value
+
+    def observe(self, name: str, labels: tuple, value: float) -> None:
+        histograms = self._store().histograms
+        histogram = histograms.get((name, labels))
+        if histogram is None:
+            histogram = histograms[(name, labels)] = [0] * (len(LATENCY_BUCKETS) + 2)
+        histogram[bisect_left(LATENCY_BUCKETS, value)] += 1
+        histogram[-1] += value
+
+    def snapshot(self) -> dict:
+        counters = defaultdict(int)
+        histograms = {}
+        with self._lock:
+            stores = list(self._stores)
+        for store in stores:
+            for key, value in store.counters.copy().items():
+                counters[key] += value
+            for key, histogram in store.histograms.copy().items():
+                _merge_histogram(histograms, key, histogram)
+        return {'counters': dict(counters), 'histograms': histograms}
+
+    def _start_flusher(self):
+        if self.directory is None or self.flush_interval is None or self._flusher_pid == os.getpid():
+            return
+        with self._lock:
+            if self._flusher_pid == os.getpid():
+                return
+            self._flusher_pid = os.getpid()
+        threading.Thread(target=self._flush_forever, name='metrics-flusher', daemon=True).start()
+        atexit.register(self.flush)
+
+    def _flush_forever(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def flush(self) -> None:
+        if self.directory is None:
+            return
+        self.directory.mkdir(parents=True, exist_ok=True)
+        snapshot = self.snapshot()
+        data = {
+            'counters': [[name, labels, value] for (name, labels), value in snapshot['counters'].items()],
+            'histograms': [[name, labels, value] for (name, labels), value in snapshot['histograms'].items()],
+        }
+        path = self.directory / f'metrics-{os.getpid()}.json'
+        tmp_path = path.with_suffix('.tmp')
+        tmp_path.write_text(json.dumps(data))
+        os.replace(tmp_path, path)
+
+    def collect(self) -> dict:
+        if self.directory is None:
+            return self.snapshot()
+        self.flush()
+        counters = defaultdict(int)
+        histograms = {}
+        for path in self.directory.glob('metrics-*.json'):
+            try:
+                data = json.loads(path.read_text())
+            except (OSError, ValueError):
+                continue
+            for name, labels, value in data['counters']:
+                counters[(name, _labels_key(labels))] += value
+            for name, labels, value in data['histograms']:
+                _merge_histogram(histograms, (name, _labels_key(labels)), value)
+        return {'counters': dict(counters), 'histograms': histograms}
+
+
+def clear_directory(directory: str | None) -> None:
+    """Remove the dumps of a previous run, called before the workers start."""
+    if not directory:
+        return
+    for path in Path(directory).glob('metrics-*.json'):
+        path.unlink(missing_ok=True)
+
+
+def mark_process_dead(directory: str | None, pid: int) -> None:
+    """
+    Add the totals of an exited worker to metrics-exited.json and remove its
+    own file, so counters keep growing while the directory holds one file per
+    live worker.
+    """
+    if not directory:
+        return
+    path = Path(directory) / f'metrics-{pid}.json'
+    try:
+        data = json.loads(path.read_text())
+    except FileNotFoundError:
+        return
+    except ValueError:
+        path.unlink(missing_ok=True)
+        return
+    exited_path = Path(directory) / 'metrics-exited.json'
+    try:
+        exited = json.loads(exited_path.read_text())
+    except (OSError, ValueError):
+        exited = {'counters': [], 'histograms': []}
+
+    counters = defaultdict(int)
+    histograms = {}
+    for name, labels, value in exited['counters'] + data['counters']:
+        counters[(name, _labels_key(labels))] += value
+    for name, labels, value in exited['histograms'] + data['histograms']:
+        _merge_histogram(histograms, (name, _labels_key(labels)), value)
+    tmp_path = exited_path.with_suffix('.tmp')
+    tmp_path.write_text(json.dumps({
+        'counters': [[name, labels, value] for (name, labels), value in counters.items()],
+        'histograms': [[name, labels, value] for (name, labels), value in histograms.items()],
+    }))
+    os.replace(tmp_path, exited_path)
+    path.unlink()
+
+
+def _labels_key(labels: list) -> tuple:
+    return tuple(tuple(pair) for pair in labels)
+
+
+def _merge_histogram(histograms: dict, key: tuple, histogram: list) -> None:
+    merged = histograms.setdefault(key, [0] * len(histogram))
+    for index, value in enumerate(histogram):
+        merged[index] += value
+
+
+def _format_labels(labels: tuple, extra: tuple = ()) -> str:
+    pairs = labels + extra
+    if not pairs:
+        return ''
+    escaped = (
+        '{}="{}"'.format(key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for key, value in pairs
+    )
+    return '{' + ','.join(escaped) + '}'
+
+
+def render_prometheus(metrics: dict) -> str:
+    lines = []
+    for name in sorted({name for name, labels in metrics['counters']}):
+        lines.append(f'# TYPE {name} counter')
+        for (metric, labels), value in sorted(metrics['counters'].items()):
+            if metric == name:
+                lines.append(f'{name}{_format_labels(labels)} {value}')
+    for name in sorted({name for name, labels in metrics['histograms']}):
+        lines.append(f'# TYPE {name} histogram')
+        for (metric, labels), histogram in sorted(metrics['histograms'].items()):
+            if metric != name:
+                continue
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS + ('+Inf',), histogram[:-1]):
+                cumulative += count
+                lines.append(f'{name}_bucket{_format_labels(labels, (("le", bound),))} {cumulative}')
+            lines.append(f'{name}_sum{_format_labels(labels)} {histogram[-1]}')
+            lines.append(f'{name}_count{_format_labels(labels)} {cumulative}')
+    return '\n'.join(lines) + '\n'
+
+
+_registry = None
+
+
+def get_registry() -> MetricsRegistry:
+    global _registry
+    if _registry is None:
+        from django.conf import settings
+        _registry = MetricsRegistry(getattr(settings, 'METRICS_DIR', None))
+    return _registry
+
+
+@receiver(setting_changed)
+def _reset_registry(*, setting, **kwargs):
+    # override_settings(METRICS_DIR=...) in benchmarks: middlewares created afterwards write there,
+    # the replaced registry stops dumping since its directory may be removed
+    global _registry
+    if setting == 'METRICS_DIR' and _registry is not None:
+        _registry.directory = None
+        _registry = None
+
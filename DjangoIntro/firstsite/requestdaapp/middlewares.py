@@ -1,37 +1,70 @@
 import time
 from http.client import responses
 
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
 from django.http import HttpRequest, HttpResponseForbidden
+from django.utils.decorators import sync_and_async_middleware
 
+from .metrics import get_registry
 
+
+@sync_and_async_middleware
 def setup_user_on_request_middleware(get_response):
-    print('init call')
-    def middleware(request: HttpRequest):
-        print('before get')
-        request.user_agent = request.META['HTTP_USER_AGENT']
-        response = get_response(request)
-        print('after get')
-        return response
+    if iscoroutinefunction(get_response):
+        async def middleware(request: HttpRequest):
+            request.user_agent = request.META.get('HTTP_USER_AGENT', '')
+            return await get_response(request)
+    else:
+        def middleware(request: HttpRequest):
+            request.user_agent = request.META.get('HTTP_USER_AGENT', '')
+            return get_response(request)
     return middleware
 
-class CountRequestMiddleware:
+class MetricsMiddleware:
+    """Counts requests, responses and exceptions and times every view."""
+    sync_capable = True
+    async_capable = True
+
     def __init__(self, get_response):
         self.get_response = get_response
-        self.requests_count = 0
-        self.responses_count = 0
-        self.exceptions_count = 0
+        self.registry = get_registry()
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
 
     def __call__(self, request: HttpRequest):
-        self.requests_count += 1
-        print("request count", self.requests_count)
+        if self.async_mode:
+            return self.__acall__(request)
+        started = time.perf_counter()
         response = self.get_response(request)
-        self.responses_count += 1
-        print('responses count', self.responses_count)
+        self.record(request, response, started)
         return response
 
+    async def __acall__(self, request: HttpRequest):
+        started = time.perf_counter()
+        response = await self.get_response(request)
+        self.record(request, response, started)
+        return response
+
+    def record(self, request: HttpRequest, response, started: float) -> None:
+        view = self.get_view_name(request)
+        self.registry.inc('http_requests_total', (
+            ('view', view),
+            ('method', request.method),
+            ('status', str(response.status_code)),
+        ))
+        self.registry.observe('http_request_duration_seconds', (('view', view),), time.perf_counter() - started)
+
     def process_exception(self, request: HttpRequest, exception: Exception):
-        self.exceptions_count += 1
-        print('got',self.exceptions_count, 'exception so far')
+        self.registry.inc('http_exceptions_total', (
+            ('view', self.get_view_name(request)),
+            ('exception', type(exception).__name__),
+        ))
+
+    @staticmethod
+    def get_view_name(request: HttpRequest) -> str:
+        resolver_match = getattr(request, 'resolver_match', None)
+        return resolver_match.view_name if resolver_match else 'unresolved'
 '''
 class ThrottlingMiddleware:
     def __init__(self, get_response):
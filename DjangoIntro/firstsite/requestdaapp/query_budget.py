@@ -0,0 +1,89 @@
+import logging
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import connections
+from django.http import HttpRequest, HttpResponse
+
+log = logging.getLogger(__name__)
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+class QueryRecorder:
+    """execute_wrapper collecting the SQL of every query on every connection."""
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        self.queries.append(sql)
+        return execute(sql, params, many, context)
+
+    @contextmanager
+    def record(self):
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(self))
+            yield self
+
+    def duplicates(self) -> list[tuple[str, int]]:
+        return [(sql, count) for sql, count in Counter(self.queries).most_common() if count > 1]
+
+
+class QueryBudgetMixin:
+    """
+    Declares how many queries a request to the view may run, session and user
+    lookups included. query_budget is a number, or for viewsets a dict by
+    action; None leaves the view unchecked.
+
+    Checked only when settings.QUERY_BUDGET_MODE is set: 'raise' (the default
+    under tests) fails the request, 'log' only logs a warning. Both report the
+    SQL that ran more than once, which is where an N+1 shows up. Templates are
+    rendered and streaming responses consumed within the budget.
+    """
+    query_budget: int | dict | None = None
+
+    def get_query_budget(self) -> int | None:
+        budget = self.query_budget
+        if isinstance(budget, dict):
+            return budget.get(getattr(self, 'action', None))
+        return budget
+
+    def dispatch(self, request: HttpRequest, *args, **kwargs) -> HttpResponse:
+        mode = getattr(settings, 'QUERY_BUDGET_MODE', '')
+        if not mode or self.query_budget is None:
+            return super().dispatch(request, *args, **kwargs)
+
+        recorder = QueryRecorder()
+        with recorder.record():
+            response = super().dispatch(request, *args, **kwargs)
+            if response.streaming:
+                response.streaming_content = self._stream_within_budget(response.streaming_content, recorder, mode)
+                return response
+            if hasattr(response, 'render') and not response.is_rendered:
+                response.render()
+        self.check_query_budget(recorder, mode)
+        return response
+
+    def _stream_within_budget(self, content, recorder: QueryRecorder, mode: str):
+        with recorder.record():
+            yield from content
+        self.check_query_budget(recorder, mode)
+
+    def check_query_budget(self, recorder: QueryRecorder, mode: str) -> None:
+        budget = self.get_query_budget()
+        if budget is None or len(recorder.queries) <= budget:
+            return
+        lines = [
+            f'{self.request.method} {self.request.path} ({type(self).__name__}) '
+            f'ran {len(recorder.queries)} queries, the budget is {budget}'
+        ]
+        lines.extend(f'  {count} x {sql}' for sql, count in recorder.duplicates())
+        message = '\n'.join(lines)
+        if mode == 'raise':
+            raise QueryBudgetExceeded(message)
+        log.warning(message)
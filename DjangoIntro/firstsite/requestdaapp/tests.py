@@ -1,3 +1,293 @@
-from django.test import TestCase
+import hashlib
+import os
+import time
+from io import BytesIO, StringIO
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from threading import Thread
+
+from asgiref.sync import iscoroutinefunction
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.http import HttpResponse, StreamingHttpResponse
+from django.core.management import call_command
+from django.test import RequestFactory, TestCase, override_settings
+from django.views import View
 
 # Create your tests here.
+from django.urls import reverse
+
+from .metrics import MetricsRegistry, clear_directory, mark_process_dead, render_prometheus
+from .middlewares import MetricsMiddleware
+from .query_budget import QueryBudgetExceeded, QueryBudgetMixin
+from .uploads import ResumableUpload, UploadRejected
+
+
+class MetricsRegistryTestCase(TestCase):
+    def test_render_prometheus(self):
+        registry = MetricsRegistry()
+        registry.inc('http_requests_total', (('view', 'index'), ('status', '200')))
+        registry.inc('http_requests_total', (('view', 'index'), ('status', '200')))
+        registry.observe('http_request_duration_seconds', (('view', 'index'),), 0.02)
+
+        text = render_prometheus(registry.collect())
+
+        self.assertIn('http_requests_total{view="index",status="200"} 2', text)
+        self.assertIn('http_request_duration_seconds_bucket{view="index",le="0.025"} 1', text)
+        self.assertIn('http_request_duration_seconds_count{view="index"} 1', text)
+
+    def test_merges_worker_files(self):
+        with TemporaryDirectory() as directory:
+            worker = MetricsRegistry(directory, flush_interval=None)
+            worker.inc('jobs_total')
+            worker.flush()
+            # pretend the dump came from another worker process
+            os.replace(Path(directory, f'metrics-{os.getpid()}.json'), Path(directory, 'metrics-1.json'))
+            second = MetricsRegistry(directory, flush_interval=None)
+            second.inc('jobs_total', value=2)
+
+            self.assertEqual(second.collect()['counters'][('jobs_total', ())], 3)
+
+    def test_exited_workers_are_merged_and_cleared_on_start(self):
+        with TemporaryDirectory() as directory:
+            worker = MetricsRegistry(directory, flush_interval=None)
+            for _ in range(2):
+                worker.inc('jobs_total')
+                worker.observe('job_duration_seconds', (), 0.02)
+                worker.flush()
+                # every round is another worker process that exits
+                os.replace(Path(directory, f'metrics-{os.getpid()}.json'), Path(directory, 'metrics-1.json'))
+                mark_process_dead(directory, 1)
+                worker = MetricsRegistry(directory, flush_interval=None)
+
+            self.assertEqual(sorted(path.name for path in Path(directory).iterdir()), ['metrics-exited.json'])
+            metrics = worker.collect()
+            self.assertEqual(metrics['counters'][('jobs_total', ())], 2)
+            self.assertEqual(metrics['histograms'][('job_duration_seconds', ())][2], 2)
+
+            clear_directory(directory)
+            self.assertEqual(list(Path(directory).iterdir()), [])
+
+
+class MetricsViewTestCase(TestCase):
+    def test_metrics_are_staff_only(self):
+        response = self.client.get(reverse('requestdaapp:metrics'))
+        self.assertEqual(response.status_code, 302)
+
+        staff = User.objects.create_user(username='metrics_staff', password='qwerty', is_staff=True)
+        self.client.force_login(staff)
+        response = self.client.get(reverse('requestdaapp:metrics'))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'http_requests_total{view="requestdaapp:metrics"')
+
+
+class MetricsMiddlewareTestCase(TestCase):
+    async def test_async_mode(self):
+        async def get_response(request):
+            return HttpResponse('ok')
+
+        middleware = MetricsMiddleware(get_response)
+        request = RequestFactory().get('/')
+        response = await middleware(request)
+
+        self.assertTrue(iscoroutinefunction(middleware))
+        self.assertEqual(response.content, b'ok')
+
+
+class UsernamesView(QueryBudgetMixin, View):
+    query_budget = 2
+
+    def get(self, request):
+        # one query per user: the N+1 the budget is there to catch
+        names = [User.objects.get(pk=pk).username for pk in User.objects.values_list('pk', flat=True)]
+        return HttpResponse(', '.join(names))
+
+
+class StreamingUsernamesView(UsernamesView):
+    def get(self, request):
+        pks = User.objects.values_list('pk', flat=True)
+        return StreamingHttpResponse(User.objects.get(pk=pk).username for pk in pks)
+
+
+class QueryBudgetTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        for i in range(3):
+            User.objects.create_user(username=f'budget_user{i}')
+
+    def test_over_budget_raises_with_duplicated_sql(self):
+        request = RequestFactory().get('/usernames/')
+        with self.assertRaisesMessage(QueryBudgetExceeded, 'ran 4 queries, the budget is 2') as context:
+            UsernamesView.as_view()(request)
+        self.assertIn('3 x SELECT', str(context.exception))
+
+        response = UsernamesView.as_view(query_budget=4)(request)
+        self.assertContains(response, 'budget_user2')
+
+    def test_streaming_response_is_counted(self):
+        response = StreamingUsernamesView.as_view()(RequestFactory().get('/usernames/'))
+        with self.assertRaises(QueryBudgetExceeded):
+            b''.join(response.streaming_content)
+
+    @override_settings(QUERY_BUDGET_MODE='log')
+    def test_log_mode(self):
+        with self.assertLogs('requestdaapp.query_budget', 'WARNING'):
+            response = UsernamesView.as_view()(RequestFactory().get('/usernames/'))
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(QUERY_BUDGET_MODE='')
+    def test_disabled(self):
+        response = UsernamesView.as_view()(RequestFactory().get('/usernames/'))
+        self.assertEqual(response.status_code, 200)
+
+
+class FileUploadTestCase(TestCase):
+    def setUp(self):
+        media = TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.media = Path(media.name)
+        media_settings = override_settings(MEDIA_ROOT=media.name, UPLOAD_MAX_SIZE=1000)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+
+    def upload(self, name: str, content: bytes):
+        return self.client.post(reverse('requestdaapp:file-upload'), {'file': SimpleUploadedFile(name, content)})
+
+    def stored_files(self) -> list[str]:
+        return sorted(str(path.relative_to(self.media)) for path in self.media.rglob('*') if path.is_file())
+
+    def test_saves_file_with_hash(self):
+        response = self.upload('notes.txt', b'hello')
+
+        self.assertContains(response, hashlib.sha256(b'hello').hexdigest())
+        self.assertEqual(self.stored_files(), ['notes.txt'])
+        self.assertEqual((self.media / 'notes.txt').read_bytes(), b'hello')
+
+    def test_refuses_large_request_by_content_length(self):
+        response = self.upload('big.bin', b'x' * 200_000)
+
+        self.assertEqual(response.status_code, 413)
+        self.assertFalse(self.media.exists() and self.stored_files())
+
+    def test_stops_streaming_file_over_limit(self):
+        response = self.upload('big.bin', b'x' * 5000)
+
+        self.assertEqual(response.status_code, 413)
+        self.assertEqual(self.stored_files(), [])
+
+    def test_rejects_file_name_before_reading_file(self):
+        response = self.upload('virus.exe', b'payload')
+
+        self.assertContains(response, 'file name should not contain')
+        self.assertFalse(self.media.exists() and self.stored_files())
+
+
+class ResumableUploadTestCase(TestCase):
+    def setUp(self):
+        media = TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.media = Path(media.name)
+        media_settings = override_settings(MEDIA_ROOT=media.name)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+        self.user = User.objects.create_user(username='uploader', password='qwerty')
+        self.client.force_login(self.user)
+
+    def start(self, name: str, size: int):
+        return self.client.post(
+            reverse('requestdaapp:resumable-upload-start'), {'name': name, 'size': size},
+            content_type='application/json',
+        )
+
+    def put(self, url: str, content: bytes, start: int, size: int):
+        return self.client.put(
+            url, content, content_type='application/octet-stream',
+            headers={'Content-Range': f'bytes {start}-{start + len(content) - 1}/{size}'},
+        )
+
+    def test_upload_in_pieces_and_resume(self):
+        content = os.urandom(3000)
+        response = self.start('data.bin', len(content))
+        self.assertEqual(response.status_code, 201)
+        url = response['Location']
+
+        self.assertEqual(self.put(url, content[:1000], 0, 3000).json()['offset'], 1000)
+        # a repeated piece is refused with the offset to resume from
+        response = self.put(url, content[:1000], 0, 3000)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(self.client.get(url)['Upload-Offset'], '1000')
+
+        response = self.put(url, content[1000:], 1000, 3000)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['sha256'], hashlib.sha256(content).hexdigest())
+        self.assertEqual((self.media / 'data.bin').read_bytes(), content)
+        self.assertEqual(list((self.media / '.partial').iterdir()), [])
+
+    def test_upload_of_another_user_is_unknown(self):
+        url = self.start('data.bin', 10)['Location']
+        self.client.force_login(User.objects.create_user(username='other'))
+
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_rejects_name_and_size(self):
+        self.assertEqual(self.start('virus.bin', 10).status_code, 400)
+        with override_settings(RESUMABLE_UPLOAD_MAX_SIZE=100):
+            self.assertEqual(self.start('data.bin', 101).status_code, 413)
+
+    def test_rejects_range_past_declared_size(self):
+        url = self.start('data.bin', 10)['Location']
+
+        self.assertEqual(self.put(url, b'x' * 11, 0, 10).status_code, 416)
+        self.assertEqual(self.put(url, b'x' * 5, 0, 5).status_code, 416)
+        self.assertEqual(self.client.get(url).json()['offset'], 0)
+
+    def test_concurrent_appends_of_one_range(self):
+        upload = ResumableUpload.start('data.bin', 8, self.user.pk, max_size=100)
+        results = []
+
+        def append():
+            try:
+                results.append(ResumableUpload(upload.id).append('bytes 0-3/8', BytesIO(b'abcd')))
+            except UploadRejected as exc:
+                results.append(exc.status)
+
+        threads = [Thread(target=append) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(sorted(results), [4, 409, 409, 409])
+        self.assertEqual(upload.path.read_bytes(), b'abcd')
+
+    def test_cleanuploads_removes_abandoned_uploads(self):
+        url = self.start('data.bin', 10)['Location']
+        fresh_url = self.start('fresh.bin', 10)['Location']
+        stale = time.time() - 2 * 24 * 60 * 60
+        for path in (self.media / '.partial').glob(f'{url.rstrip("/").rsplit("/", 1)[-1]}.*'):
+            os.utime(path, (stale, stale))
+
+        call_command('cleanuploads', stdout=StringIO())
+
+        self.assertEqual(self.client.get(url).status_code, 404)
+        self.assertEqual(self.client.get(fresh_url).status_code, 200)
+
+    def test_cleanuploads_ages_uploads_by_received_data(self):
+        url = self.start('data.bin', 10)['Location']
+        upload_id = url.rstrip('/').rsplit('/', 1)[-1]
+        stale = time.time() - 2 * 24 * 60 * 60
+        # the metadata is as old as the upload, the last piece arrived just now
+        os.utime(self.media / '.partial' / f'{upload_id}.json', (stale, stale))
+        self.assertEqual(self.put(url, b'x' * 5, 0, 10).status_code, 200)
+
+        call_command('cleanuploads', stdout=StringIO())
+
+        self.assertEqual(self.put(url, b'x' * 5, 5, 10).status_code, 201)
+
+    def test_metadata_without_partial_file_is_unknown(self):
+        url = self.start('data.bin', 10)['Location']
+        (self.media / '.partial' / f'{url.rstrip("/").rsplit("/", 1)[-1]}.part').unlink()
+
+        self.assertEqual(self.client.get(url).status_code, 404)
+        self.assertEqual(self.put(url, b'x' * 10, 0, 10).status_code, 404)
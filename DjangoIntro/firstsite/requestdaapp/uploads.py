@@ -0,0 +1,262 @@
+import hashlib
+import json
+import os
+import re
+import time
+import uuid
+from pathlib import Path
+from typing import Callable, Iterable
+
+from django.core.exceptions import ValidationError
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler, StopFutureHandlers, StopUpload
+
+try:
+    import fcntl
+except ImportError:  # Windows: appends of one upload are not serialized
+    fcntl = None
+
+# partial files live under the storage root, so finishing an upload is a rename on one filesystem
+PARTIAL_DIR = '.partial'
+CHUNK_SIZE = 64 * 2 ** 10
+# room for the boundaries and the other form fields around the file
+MULTIPART_OVERHEAD = 64 * 2 ** 10
+
+
+class UploadRejected(Exception):
+    def __init__(self, message: str, status: int = 400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+def partial_path(storage: FileSystemStorage, name: str) -> Path:
+    path = Path(storage.path(PARTIAL_DIR)) / name
+    path.parent.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def validate_name(name: str, validators: Iterable[Callable]) -> None:
+    try:
+        for validator in validators:
+            validator(UploadedFile(name=name))
+    except ValidationError as exc:
+        raise UploadRejected('; '.join(exc.messages))
+
+
+class StreamedUploadedFile(UploadedFile):
+    """
+    An upload already written to a partial file under the storage root, with
+    its sha256. FileSystemStorage.save() moves it into place by its
+    temporary_file_path() instead of copying; a partial file that was never
+    saved is deleted on close.
+    """
+
+    def __init__(self, file, path: Path, name: str, content_type: str | None, size: int, charset: str | None,
+                 sha256: str, content_type_extra: dict | None = None):
+        super().__init__(file, name, content_type, size, charset, content_type_extra)
+        self.path = path
+        self.sha256 = sha256
+
+    def temporary_file_path(self) -> str:
+        return str(self.path)
+
+    def close(self):
+        try:
+            return self.file.close()
+        finally:
+            self.path.unlink(missing_ok=True)
+
+
+class StreamingUploadHandler(FileUploadHandler):
+    """
+    Validates an upload while it streams in: the request is refused by its
+    Content-Length before any of the body is read, a file name rejected by
+    the validators or a file outgrowing max_size stops the parsing at once.
+    Chunks are hashed and written straight to a partial file next to their
+    final location. The reason of a rejection is kept in self.error.
+    """
+    chunk_size = CHUNK_SIZE
+
+    def __init__(self, request=None, max_size: int | None = None, name_validators: Iterable[Callable] = (),
+                 storage: FileSystemStorage | None = None):
+        super().__init__(request)
+        self.max_size = max_size
+        self.name_validators = tuple(name_validators)
+        self.storage = storage or default_storage
+        self.error: UploadRejected | None = None
+
+    def check_content_length(self, content_length: int) -> None:
+        if self.max_size is not None and content_length > self.max_size + MULTIPART_OVERHEAD:
+            raise UploadRejected(f'The file is too large (at most {self.max_size} bytes)', status=413)
+
+    def reject(self, error: UploadRejected):
+        self.error = error
+        raise StopUpload(connection_reset=True)
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        try:
+            validate_name(self.file_name, self.name_validators)
+        except UploadRejected as exc:
+            self.reject(exc)
+        self.path = partial_path(self.storage, uuid.uuid4().hex)
+        self.file = open(self.path, 'w+b')
+        self.sha256 = hashlib.sha256()
+        raise StopFutureHandlers()
+
+    def receive_data_chunk(self, raw_data: bytes, start: int):
+        if self.max_size is not None and start + len(raw_data) > self.max_size:
+            self.reject(UploadRejected(f'The file is too large (at most {self.max_size} bytes)', status=413))
+        self.sha256.update(raw_data)
+        self.file.write(raw_data)
+
+    def file_complete(self, file_size: int):
+        self.file.flush()
+        self.file.seek(0)
+        return StreamedUploadedFile(
+            self.file, self.path, self.file_name, self.content_type, file_size,
+            self.charset, self.sha256.hexdigest(), self.content_type_extra,
+        )
+
+    def upload_interrupted(self):
+        if hasattr(self, 'file'):
+            self.file.close()
+            self.path.unlink(missing_ok=True)
+
+    def upload_complete(self):
+        if self.error is not None:
+            self.upload_interrupted()
+
+
+CONTENT_RANGE_RE = re.compile(r'^bytes (\d+)-(\d+)/(\d+)$')
+
+
+class ResumableUpload:
+    """
+    A large file uploaded in pieces over several requests. The received bytes
+    are appended to a partial file, so the offset to resume from is its size;
+    the name, expected size and owner are kept in a JSON file beside it.
+    Once complete the file is hashed and moved into the storage.
+    """
+
+    def __init__(self, upload_id: str, storage: FileSystemStorage | None = None):
+        if not re.fullmatch(r'[0-9a-f]{32}', upload_id):
+            raise UploadRejected('Unknown upload', status=404)
+        self.id = upload_id
+        self.storage = storage or default_storage
+        self.path = partial_path(self.storage, f'{upload_id}.part')
+        self.meta_path = self.path.with_suffix('.json')
+        try:
+            self.meta = json.loads(self.meta_path.read_text())
+        except FileNotFoundError:
+            raise UploadRejected('Unknown upload', status=404)
+        if not self.path.exists():
+            # metadata left behind by a cleanup or crash, the received bytes are gone
+            raise UploadRejected('Unknown upload', status=404)
+
+    @classmethod
+    def start(cls, name: str, size: int, user_id: int, max_size: int, name_validators: Iterable[Callable] = (),
+              storage: FileSystemStorage | None = None) -> 'ResumableUpload':
+        name = name.replace('\\', '/').rsplit('/', 1)[-1]
+        if name in {'', '.', '..'}:
+            raise UploadRejected('A file name is required')
+        validate_name(name, name_validators)
+        if not 0 < size <= max_size:
+            raise UploadRejected(f'The file size must be between 1 and {max_size} bytes', status=413)
+        storage = storage or default_storage
+        upload_id = uuid.uuid4().hex
+        path = partial_path(storage, f'{upload_id}.part')
+        path.touch()
+        path.with_suffix('.json').write_text(json.dumps({'name': name, 'size': size, 'user_id': user_id}))
+        return cls(upload_id, storage)
+
+    @property
+    def offset(self) -> int:
+        return self.path.stat().st_size
+
+    @property
+    def size(self) -> int:
+        return self.meta['size']
+
+    def append(self, content_range: str, stream, chunk_size: int = CHUNK_SIZE) -> int:
+        """Write the range of the request body at the current offset; returns the new offset."""
+        match = CONTENT_RANGE_RE.match(content_range or '')
+        if not match:
+            raise UploadRejected('Content-Range: bytes <start>-<end>/<size> is required')
+        start, end, total = map(int, match.groups())
+        if total != self.size or end < start or end >= total:
+            raise UploadRejected('Content-Range does not match the upload', status=416)
+
+        remaining = end - start + 1
+        with open(self.path, 'ab') as file:
+            if fcntl is not None:
+                # a retried or concurrent PUT of the same range waits here and then sees the new offset
+                fcntl.flock(file.fileno(), fcntl.LOCK_EX)
+            offset = os.fstat(file.fileno()).st_size
+            if start != offset:
+                raise UploadRejected(f'Expected the range to start at {offset}', status=409)
+            while remaining and (chunk := stream.read(min(chunk_size, remaining))):
+                file.write(chunk)
+                remaining -= len(chunk)
+        if remaining:
+            # an incomplete range is kept, the client resumes from the new offset
+            raise UploadRejected('The request body is shorter than its Content-Range', status=400)
+        return self.offset
+
+    def finish(self) -> StreamedUploadedFile:
+        if self.offset != self.size:
+            raise UploadRejected(f'The upload has {self.offset} of {self.size} bytes', status=416)
+        try:
+            # whoever removes the metadata finishes the upload, a concurrent request gets a 404
+            self.meta_path.unlink()
+        except FileNotFoundError:
+            raise UploadRejected('Unknown upload', status=404)
+        sha256 = hashlib.sha256()
+        file = open(self.path, 'rb')
+        while chunk := file.read(CHUNK_SIZE):
+            sha256.update(chunk)
+        file.seek(0)
+        return StreamedUploadedFile(file, self.path, self.meta['name'], None, self.size, None, sha256.hexdigest())
+
+    def cancel(self) -> None:
+        self.path.unlink(missing_ok=True)
+        self.meta_path.unlink(missing_ok=True)
+
+
+def remove_stale_partials(max_age: float, storage: FileSystemStorage | None = None) -> int:
+    """
+    Delete the partial files of uploads untouched for max_age seconds; returns how many.
+    A resumable upload is aged by its .part file, which every append touches, and
+    loses its metadata together with it.
+    """
+    directory = Path((storage or default_storage).path(PARTIAL_DIR))
+    if not directory.is_dir():
+        return 0
+    deadline = time.time() - max_age
+    removed = 0
+    for path in directory.iterdir():
+        try:
+            if not path.is_file() or path.stat().st_mtime >= deadline:
+                continue
+            if path.suffix == '.json':
+                # the metadata of a resumable upload goes with its .part file
+                if path.with_suffix('.part').exists():
+                    continue
+                path.unlink()
+            elif path.suffix == '.part':
+                with open(path, 'ab') as file:
+                    if fcntl is not None:
+                        # an append in progress finishes first and makes the upload fresh again
+                        fcntl.flock(file.fileno(), fcntl.LOCK_EX)
+                    if os.fstat(file.fileno()).st_mtime >= deadline:
+                        continue
+                    path.with_suffix('.json').unlink(missing_ok=True)
+                    path.unlink()
+            else:
+                path.unlink()
+            removed += 1
+        except FileNotFoundError:
+            continue
+    return removed
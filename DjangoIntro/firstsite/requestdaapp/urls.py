@@ -1,10 +1,15 @@
 from django.urls import path
 
-from .views import process_get_view, user_form, handle_file_upload
+from .views import (
+    process_get_view, user_form, handle_file_upload, metrics_view, resumable_upload_start, resumable_upload,
+)
 app_name = 'requestdaapp'
 
 urlpatterns = [
     path('get/', process_get_view, name='get-view'),
     path('bio/', user_form, name='user-form'),
     path('upload/', handle_file_upload, name='file-upload'),
+    path('upload/resumable/', resumable_upload_start, name='resumable-upload-start'),
+    path('upload/resumable/<str:upload_id>/', resumable_upload, name='resumable-upload'),
+    path('metrics/', metrics_view, name='metrics'),
 ]
\ No newline at end of file
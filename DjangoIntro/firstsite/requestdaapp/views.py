@@ -1,8 +1,21 @@
-from django.core.files.storage import FileSystemStorage
-from django.http import HttpRequest, HttpResponse, HttpResponseForbidden
+import json
+import logging
+
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
+from django.contrib.auth.decorators import login_required
+from django.core.files.storage import default_storage
+from django.http import HttpRequest, HttpResponse, JsonResponse
 from django.shortcuts import render
+from django.urls import reverse
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
+from django.views.decorators.http import require_http_methods, require_POST
+
+from .forms import UserBioForm, UploadFileForm, validate_file_name
+from .metrics import get_registry, render_prometheus
+from .uploads import ResumableUpload, StreamingUploadHandler, UploadRejected
 
-from .forms import UserBioForm, UploadFileForm
+log = logging.getLogger(__name__)
 
 
 # Create your views here.
@@ -23,20 +36,38 @@ def user_form(request: HttpRequest)-> HttpResponse:
     }
     return render(request, 'requestdataapp/user-bio-form.html', context=context)
 
-def handle_file_upload(request: HttpRequest)-> HttpResponse:
-    print('dfg')
+@csrf_exempt
+def handle_file_upload(request: HttpRequest) -> HttpResponse:
+    # the upload handlers have to be replaced before anything reads request.POST,
+    # csrf checks included, hence the exempt wrapper around a protected view
+    if request.method == 'POST':
+        handler = StreamingUploadHandler(
+            request, max_size=settings.UPLOAD_MAX_SIZE, name_validators=[validate_file_name],
+        )
+        try:
+            handler.check_content_length(int(request.META.get('CONTENT_LENGTH') or 0))
+        except UploadRejected as exc:
+            return HttpResponse(exc.message, status=exc.status)
+        request.upload_handlers = [handler]
+    return _handle_file_upload(request)
+
+
+@csrf_protect
+def _handle_file_upload(request: HttpRequest) -> HttpResponse:
     if request.method == 'POST':
         form = UploadFileForm(request.POST, request.FILES)
-        if form.is_valid():
+        error = request.upload_handlers[0].error
+        if error is not None and error.status == 413:
+            return HttpResponse(error.message, status=error.status)
+        if error is not None:
+            form.add_error('file', error.message)
+        elif form.is_valid():
             myfile = form.cleaned_data['file']
-            file_size = myfile.size / 1024 / 1024
-            if file_size < 1:
-                fs = FileSystemStorage()
-                filename = fs.save(myfile.name, myfile)
-                print('saved file', filename)
-                return render(request, 'requestdataapp/file-upload.html')
-            else:
-                return HttpResponseForbidden("Файл слишком большой (максимум 1 МБ)")
+            filename = default_storage.save(myfile.name, myfile)
+            log.info('Saved upload %s (sha256 %s)', filename, myfile.sha256)
+            return render(request, 'requestdataapp/file-upload.html', context={
+                'form': UploadFileForm(), 'filename': filename, 'sha256': myfile.sha256,
+            })
     else:
         form = UploadFileForm()
     context = {
@@ -44,3 +75,67 @@ def handle_file_upload(request: HttpRequest)-> HttpResponse:
         }
     return render(request, 'requestdataapp/file-upload.html', context=context)
 
+
+def _upload_state(upload: ResumableUpload, status: int = 200) -> JsonResponse:
+    response = JsonResponse({'id': upload.id, 'offset': upload.offset, 'size': upload.size}, status=status)
+    response['Upload-Offset'] = upload.offset
+    return response
+
+
+@login_required
+@require_POST
+def resumable_upload_start(request: HttpRequest) -> HttpResponse:
+    """Starts a resumable upload from a JSON body {"name": ..., "size": ...}."""
+    try:
+        data = json.loads(request.body)
+        upload = ResumableUpload.start(
+            str(data['name']), int(data['size']), request.user.pk,
+            max_size=settings.RESUMABLE_UPLOAD_MAX_SIZE, name_validators=[validate_file_name],
+        )
+    except (ValueError, TypeError, KeyError):
+        return JsonResponse({'detail': 'A JSON body with name and size is required'}, status=400)
+    except UploadRejected as exc:
+        return JsonResponse({'detail': exc.message}, status=exc.status)
+    response = _upload_state(upload, status=201)
+    response['Location'] = reverse('requestdaapp:resumable-upload', kwargs={'upload_id': upload.id})
+    return response
+
+
+@login_required
+@require_http_methods(['GET', 'HEAD', 'PUT', 'DELETE'])
+def resumable_upload(request: HttpRequest, upload_id: str) -> HttpResponse:
+    """
+    GET tells the offset to resume from, PUT appends the body at the range
+    given by Content-Range and finishes the upload with its last byte,
+    DELETE abandons it.
+    """
+    try:
+        upload = ResumableUpload(upload_id)
+        if upload.meta['user_id'] != request.user.pk:
+            raise UploadRejected('Unknown upload', status=404)
+        if request.method == 'DELETE':
+            upload.cancel()
+            return HttpResponse(status=204)
+        if request.method == 'PUT':
+            upload.append(request.META.get('HTTP_CONTENT_RANGE'), request)
+    except UploadRejected as exc:
+        return JsonResponse({'detail': exc.message}, status=exc.status)
+    if upload.offset < upload.size:
+        return _upload_state(upload)
+
+    try:
+        uploaded = upload.finish()
+    except UploadRejected as exc:
+        return JsonResponse({'detail': exc.message}, status=exc.status)
+    try:
+        filename = default_storage.save(uploaded.name, uploaded)
+    finally:
+        uploaded.close()
+    log.info('Saved resumable upload %s (sha256 %s)', filename, uploaded.sha256)
+    return JsonResponse({'name': filename, 'size': uploaded.size, 'sha256': uploaded.sha256}, status=201)
+
+
+@staff_member_required
+def metrics_view(request: HttpRequest) -> HttpResponse:
+    metrics = get_registry().collect()
+    return HttpResponse(render_prometheus(metrics), content_type='text/plain; version=0.0.4')
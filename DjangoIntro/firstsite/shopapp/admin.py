@@ -1,31 +1,34 @@
-from csv import DictReader
-from io import TextIOWrapper
-
 from django.contrib import admin
 from django.contrib.auth.models import User
 from django.db.models import QuerySet
-from django.http import HttpRequest, HttpResponse
-from django.shortcuts import render, redirect
-from django.urls import path
+from django.http import FileResponse, Http404, HttpRequest, HttpResponse, JsonResponse
+from django.shortcuts import get_object_or_404, render, redirect
+from django.urls import path, reverse
 
 # Register your models here.
-from .models import Product, Order
+from .models import Job, Product, Order
 from .admin_mixins import ExportAsCSVMixin
+from .bulk import set_archived
 from .forms import CSVImportForm
+from .jobs import enqueue
+from .search import get_search_backend
 
 class OrderInline(admin.TabularInline):
     model = Product.orders.through
 
 @admin.action(description='Archive product')
 def mark_archived(modeladmin: admin.ModelAdmin, requests: HttpRequest, queryset: QuerySet):
-    queryset.update(archived=True)
+    updated = set_archived(queryset, True, batch_size=modeladmin.archive_batch_size)
+    modeladmin.message_user(requests, f'Archived {updated} products')
 
 @admin.action(description='Unarchive product')
 def mark_unarchived(modeladmin: admin.ModelAdmin, requests: HttpRequest, queryset: QuerySet):
-    queryset.update(archived=False)
+    updated = set_archived(queryset, False, batch_size=modeladmin.archive_batch_size)
+    modeladmin.message_user(requests, f'Unarchived {updated} products')
 
 @admin.register(Product)
 class ProductAdmin(admin.ModelAdmin, ExportAsCSVMixin):
+    archive_batch_size = 1000
     actions = [
         mark_archived,
         mark_unarchived,
@@ -37,7 +40,7 @@ class ProductAdmin(admin.ModelAdmin, ExportAsCSVMixin):
     list_display = 'pk', 'name', 'description_short', 'price', 'discount', 'archived'
     list_display_links = 'pk','name'
     ordering = '-name', 'pk'
-    search_fields = 'name', 'description', 'price'
+    search_fields = 'name', 'description'
     fieldsets = [
         (None, {
            'fields': ('name', 'description'),
@@ -71,6 +74,11 @@ class ProductAdmin(admin.ModelAdmin, ExportAsCSVMixin):
         ]
         return new_urls + urls
 
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term.strip():
+            return queryset, False
+        return get_search_backend(queryset.db).search(queryset, search_term), False
+
     def description_short(self, obj: Product) -> str:
         if len(obj.description) < 48:
             return obj.description
@@ -87,7 +95,9 @@ class OrderAdmin(admin.ModelAdmin):
     inlines = [
         ProductInline,
     ]
-    list_display = 'delivery_address', 'promocode', 'created_at', 'user_verbose'
+    list_display = 'delivery_address', 'promocode', 'created_at', 'user_verbose', \
+        'product_count', 'total_price', 'total_discounted_price'
+    import_batch_size = 1000
 
     def get_queryset(self, request):
         return Order.objects.select_related('user').prefetch_related('products')
@@ -110,34 +120,14 @@ class OrderAdmin(admin.ModelAdmin):
             }
             return render(request, 'admin/csv_form.html', context, status=400)
 
-        csv_file = TextIOWrapper(
-            form.files['csv_file'].file,
-            encoding=request.encoding,
+        job = enqueue(
+            Job.Kind.IMPORT_ORDERS,
+            params={'encoding': request.encoding or 'utf-8', 'batch_size': self.import_batch_size},
+            input_file=form.files['csv_file'],
+            user=request.user,
         )
-        reader = DictReader(csv_file)
-
-        orders = []
-        for row in reader:
-            order = Order(
-                delivery_address=row['delivery_address'],
-                promocode=row['promocode'],
-                user_id=row['user_id'],
-            )
-            orders.append(order)
-
-        Order.objects.bulk_create(orders)
-
-        csv_file.seek(0)
-        next(reader)
-
-        for row, order in zip(reader, orders):
-            if 'products' in row:
-                product_ids = [int(pid) for pid in row['products'].split(',') if pid.strip()]
-                products = Product.objects.filter(id__in=product_ids)
-                order.products.set(products)
-
-        self.message_user(request, 'Data from CSV was imported')
-        return redirect('..')
+        self.message_user(request, f'Import queued as job #{job.pk}')
+        return redirect(reverse('admin:shopapp_job_change', args=[job.pk]))
 
     def get_urls(self):
         urls = super().get_urls()
@@ -150,4 +140,59 @@ class OrderAdmin(admin.ModelAdmin):
             ),
         ]
 
-        return custom_urls + urls
\ No newline at end of file
+        return custom_urls + urls
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    change_form_template = 'admin/shopapp/job/change_form.html'
+    list_display = 'pk', 'kind', 'status', 'progress', 'created_by', 'created_at', 'finished_at'
+    list_filter = 'kind', 'status'
+    list_select_related = 'created_by',
+    readonly_fields = [field.name for field in Job._meta.fields] + ['progress']
+
+    def has_add_permission(self, request: HttpRequest) -> bool:
+        return False
+
+    def has_change_permission(self, request: HttpRequest, obj=None) -> bool:
+        return False
+
+    @admin.display(description='Progress')
+    def progress(self, obj: Job) -> str:
+        if obj.percent is None:
+            return f'{obj.processed}'
+        return f'{obj.percent}% ({obj.processed} / {obj.total})'
+
+    def status_view(self, request: HttpRequest, object_id: str) -> JsonResponse:
+        job = get_object_or_404(Job, pk=object_id)
+        return JsonResponse({
+            'status': job.status,
+            'processed': job.processed,
+            'total': job.total,
+            'percent': job.percent,
+            'message': job.message,
+            'finished': job.finished,
+            'download_url': reverse('admin:shopapp_job_download', args=[job.pk]) if job.result_file else None,
+        })
+
+    def download_view(self, request: HttpRequest, object_id: str) -> FileResponse:
+        job = get_object_or_404(Job, pk=object_id)
+        if not job.result_file:
+            raise Http404('The job has no result file')
+        return FileResponse(job.result_file.open('rb'), as_attachment=True,
+                            filename=job.result_file.name.rsplit('/', 1)[-1])
+
+    def get_urls(self):
+        custom_urls = [
+            path(
+                '<path:object_id>/status/',
+                self.admin_site.admin_view(self.status_view),
+                name='shopapp_job_status',
+            ),
+            path(
+                '<path:object_id>/download/',
+                self.admin_site.admin_view(self.download_view),
+                name='shopapp_job_download',
+            ),
+        ]
+        return custom_urls + super().get_urls()
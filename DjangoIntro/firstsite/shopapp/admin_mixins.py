@@ -1,18 +1,24 @@
-import csv
 from django.db.models import QuerySet
-from django.db.models.options import Options
-from django.http import HttpRequest, HttpResponse
+from django.http import HttpRequest
+from django.shortcuts import redirect
+from django.urls import reverse
+
+from .jobs import enqueue
+from .models import Job
 
 
 class ExportAsCSVMixin:
-    def export_cvs(self, request: HttpRequest, queryset: QuerySet):
-        meta: Options = self.model._meta
-        field_names = [field.name for field in meta.fields]
+    export_chunk_size = 2000
 
-        response = HttpResponse(content_type='text/csv')
-        response['Content-Disposition'] = f'attachment; filename={meta}-export.csv'
-        csv_writer = csv.writer(response)
-        csv_writer.writerow(field_names)
-        for obj in queryset:
-            csv_writer.writerow([getattr(obj, field) for field in field_names])
-        return response
\ No newline at end of file
+    def export_cvs(self, request: HttpRequest, queryset: QuerySet):
+        """Queue the export as a background job and send the admin to its progress page."""
+        params = {'model': self.model._meta.label_lower, 'chunk_size': self.export_chunk_size}
+        if request.POST.get('select_across') == '1':
+            # "select all": the worker replays the changelist filters instead of getting every pk
+            params['changelist_filters'] = request.GET.urlencode()
+        else:
+            # checked rows, at most a page of the changelist
+            params['pks'] = list(queryset.values_list('pk', flat=True))
+        job = enqueue(Job.Kind.EXPORT_CSV, params=params, user=request.user)
+        self.message_user(request, f'Export queued as job #{job.pk}')
+        return redirect(reverse('admin:shopapp_job_change', args=[job.pk]))
@@ -0,0 +1,127 @@
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Prefetch, QuerySet
+from rest_framework import status
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.permissions import DjangoModelPermissions
+from rest_framework.relations import ManyRelatedField, PrimaryKeyRelatedField
+from rest_framework.request import Request
+from rest_framework.response import Response
+from rest_framework.serializers import BaseSerializer
+
+from .serializers import get_requested_fields
+
+
+def optimize_for_serializer(queryset: QuerySet, serializer: BaseSerializer) -> QuerySet:
+    """
+    Add select_related/prefetch_related for the relations the serializer renders.
+    Primary key relations are read from <field>_id, pk lists are prefetched
+    with only the related pk column.
+    """
+    meta = queryset.model._meta
+    select, prefetch = [], []
+    for field in serializer.fields.values():
+        if field.write_only or '.' in field.source or field.source == '*':
+            continue
+        try:
+            model_field = meta.get_field(field.source)
+        except FieldDoesNotExist:
+            continue
+        if not model_field.is_relation:
+            continue
+        related_model = model_field.related_model
+        if isinstance(field, ManyRelatedField) and isinstance(field.child_relation, PrimaryKeyRelatedField):
+            prefetch.append(Prefetch(field.source, queryset=related_model.objects.only(related_model._meta.pk.name)))
+        elif model_field.many_to_many or model_field.one_to_many:
+            prefetch.append(field.source)
+        elif not isinstance(field, PrimaryKeyRelatedField):
+            select.append(field.source)
+    if select:
+        queryset = queryset.select_related(*select)
+    if prefetch:
+        queryset = queryset.prefetch_related(*prefetch)
+    return queryset
+
+
+class SerializerQuerysetMixin:
+    """Builds select_related/prefetch_related from the fields of the serializer."""
+    def get_queryset(self) -> QuerySet:
+        return optimize_for_serializer(super().get_queryset(), self.get_serializer())
+
+    def filter_queryset(self, queryset: QuerySet) -> QuerySet:
+        filtered = super().filter_queryset(queryset)
+        if not filtered.query.distinct:
+            return filtered
+        # filters over multi-valued relations add DISTINCT over every selected
+        # column; an IN over the matching primary keys removes duplicates cheaper
+        matching = filtered.order_by().values('pk')
+        matching.query.distinct = False
+        return queryset.filter(pk__in=matching).order_by(*filtered.query.order_by)
+
+
+class SparseFieldsetViewMixin:
+    """Selects only the columns asked for with ?fields= (plus pk and ordering fields)."""
+    always_selected = ('created_at',)
+
+    def get_queryset(self) -> QuerySet:
+        queryset = super().get_queryset()
+        requested = get_requested_fields(self.request)
+        if not requested:
+            return queryset
+        meta = queryset.model._meta
+        concrete = {field.name for field in meta.concrete_fields}
+        ordering = self.request.query_params.get('ordering', '')
+        wanted = set(requested) | set(self.always_selected) | {
+            name.strip().lstrip('-') for name in ordering.split(',')
+        }
+        return queryset.only(meta.pk.name, *sorted(wanted & concrete))
+
+
+class ChangeModelPermissions(DjangoModelPermissions):
+    """For POST actions that change existing rows: they need change_<model>, not add_<model>."""
+    perms_map = {**DjangoModelPermissions.perms_map, 'POST': ['%(app_label)s.change_%(model_name)s']}
+
+
+class BulkWriteMixin:
+    """
+    Bulk writes for a viewset whose serializer uses BulkListSerializer:
+    POST of a JSON list creates every item, PATCH bulk-update/ with a list of
+    {"pk": ..., <fields>} partially updates them. Both are all-or-nothing; the
+    add_<model> and change_<model> permissions are checked by the viewset's
+    DjangoModelPermissions like for single items.
+    """
+    bulk_max_items = 2000
+
+    def create(self, request: Request, *args, **kwargs) -> Response:
+        if not isinstance(request.data, list):
+            return super().create(request, *args, **kwargs)
+        serializer = self.get_serializer(data=request.data, many=True, max_length=self.bulk_max_items)
+        serializer.is_valid(raise_exception=True)
+        self.perform_create(serializer)
+        return Response(self.get_bulk_response_data(serializer.instance), status=status.HTTP_201_CREATED)
+
+    @action(detail=False, methods=['patch'], url_path='bulk-update')
+    def bulk_update(self, request: Request, *args, **kwargs) -> Response:
+        items = request.data
+        if not isinstance(items, list):
+            raise ValidationError({'non_field_errors': ['Expected a list of items.']})
+        pks = [item.get('pk') if isinstance(item, dict) else None for item in items]
+        if not all(isinstance(pk, int) and not isinstance(pk, bool) for pk in pks):
+            raise ValidationError({'non_field_errors': ['Every item needs an integer pk.']})
+        if len(set(pks)) != len(pks):
+            raise ValidationError({'non_field_errors': ['Duplicate pks.']})
+        if len(pks) > self.bulk_max_items:
+            raise ValidationError({'non_field_errors': [f'At most {self.bulk_max_items} items per request.']})
+        found = self.queryset.model.objects.in_bulk(pks)
+        missing = [pk for pk in pks if pk not in found]
+        if missing:
+            raise ValidationError({'non_field_errors': [f'Unknown pks: {missing}']})
+
+        serializer = self.get_serializer([found[pk] for pk in pks], data=items, many=True, partial=True)
+        serializer.is_valid(raise_exception=True)
+        instances = serializer.save()
+        return Response(self.get_bulk_response_data(instances))
+
+    def get_bulk_response_data(self, instances: list) -> list:
+        queryset = self.get_queryset().filter(pk__in=[instance.pk for instance in instances])
+        return self.get_serializer(queryset, many=True).data
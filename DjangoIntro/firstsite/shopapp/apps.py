@@ -4,3 +4,10 @@ from django.apps import AppConfig
 class ShopappConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'shopapp'
+
+    def ready(self):
+        from django.db.models.signals import post_migrate
+
+        from . import signals  # noqa: F401
+        from .search import install_search_backend
+        post_migrate.connect(install_search_backend, sender=self)
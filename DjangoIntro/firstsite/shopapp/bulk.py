@@ -0,0 +1,46 @@
+from typing import Iterable
+
+from django.db import transaction
+from django.db.models import F, QuerySet
+from django.utils import timezone
+
+from .caching import bump_catalog_state, bump_user_orders_version_on_commit
+from .models import Order, Product
+
+
+def set_archived(queryset: QuerySet, archived: bool, batch_size: int = 1000) -> int:
+    """
+    Archive or unarchive the products of the queryset: one UPDATE per batch
+    of primary keys (keyset over pk), so a large selection never holds a
+    long lock, and one cache invalidation per batch instead of per product.
+    Products already in the requested state are left alone.
+    """
+    pks_queryset = queryset.exclude(archived=archived).order_by('pk').values_list('pk', flat=True)
+    updated = 0
+    last_pk = 0
+    while pks := list(pks_queryset.filter(pk__gt=last_pk)[:batch_size]):
+        with transaction.atomic():
+            updated += Product.objects.filter(pk__in=pks).update(
+                archived=archived,
+                revision=F('revision') + 1,
+                updated_at=timezone.now(),
+            )
+        # search indexes only cover name and description, so only the page caches are affected
+        bump_catalog_state()
+        last_pk = pks[-1]
+    return updated
+
+
+def products_written(products: list[Product], updated_fields: Iterable[str] = ()) -> None:
+    """Invalidation after bulk_create/bulk_update of products, which send no signals."""
+    bump_catalog_state()
+    if {'price', 'discount'} & set(updated_fields):
+        items = Order.products.through.objects.filter(product_id__in=[product.pk for product in products])
+        Order.objects.filter(pk__in=items.values('order_id')).refresh_totals()
+
+
+def orders_written(orders: list[Order], previous_user_ids: Iterable[int] = ()) -> None:
+    """Totals and per-user cache versions after bulk writes of orders and their products."""
+    Order.objects.filter(pk__in=[order.pk for order in orders]).refresh_totals()
+    for user_id in {order.user_id for order in orders} | set(previous_user_ids):
+        bump_user_orders_version_on_commit(user_id, using=Order.objects.db)
@@ -0,0 +1,93 @@
+import time
+from datetime import datetime
+from functools import partial
+from typing import Callable
+from uuid import uuid4
+
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+
+def user_orders_version_key(user_id: int) -> str:
+    return f'user_{user_id}_orders_version'
+
+
+def get_user_orders_version(user_id: int) -> int:
+    key = user_orders_version_key(user_id)
+    cache.add(key, 1, None)
+    return cache.get(key, 1)
+
+
+def bump_user_orders_version(user_id: int) -> None:
+    key = user_orders_version_key(user_id)
+    cache.add(key, 1, None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # the key was culled between add() and incr()
+        cache.set(key, 2, None)
+
+
+def bump_user_orders_version_on_commit(user_id: int, using: str | None = None) -> None:
+    """
+    Bump once the writing transaction commits: bumped earlier, a concurrent
+    request could rebuild from the rows being replaced and cache them under
+    the new version.
+    """
+    transaction.on_commit(partial(bump_user_orders_version, user_id), using=using)
+
+
+def user_orders_export_key(user_id: int) -> str:
+    version = get_user_orders_version(user_id)
+    return f'user_{user_id}_orders_export_v{version}'
+
+
+def get_or_build(key: str, build: Callable[[], object], timeout: int,
+                 lock_timeout: int = 10, poll_interval: float = 0.05):
+    """
+    Read-through cache with stampede protection: only the request holding
+    the lock runs build(), concurrent requests wait for its result.
+    """
+    data = cache.get(key)
+    if data is not None:
+        return data
+
+    lock_key = f'{key}_lock'
+    if cache.add(lock_key, 1, lock_timeout):
+        try:
+            data = build()
+            cache.set(key, data, timeout)
+        finally:
+            cache.delete(lock_key)
+        return data
+
+    deadline = time.monotonic() + lock_timeout
+    while time.monotonic() < deadline:
+        time.sleep(poll_interval)
+        data = cache.get(key)
+        if data is not None:
+            return data
+    return build()
+
+
+CATALOG_STATE_KEY = 'catalog_state'
+
+
+def _new_catalog_state() -> tuple[str, datetime]:
+    # a fresh token rather than a counter, so losing the key never brings back an old ETag
+    return uuid4().hex, timezone.now()
+
+
+async def aget_catalog_state() -> tuple[str, datetime]:
+    """Token and modification time of the product catalog, changed on every product write."""
+    state = await cache.aget(CATALOG_STATE_KEY)
+    if state is None:
+        state = _new_catalog_state()
+        if not await cache.aadd(CATALOG_STATE_KEY, state, None):
+            state = await cache.aget(CATALOG_STATE_KEY, state)
+    return state
+
+
+def bump_catalog_state() -> None:
+    cache.set(CATALOG_STATE_KEY, _new_catalog_state(), None)
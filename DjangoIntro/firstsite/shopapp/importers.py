@@ -0,0 +1,113 @@
+from contextlib import nullcontext
+from itertools import islice
+from typing import Callable, Iterable, Iterator
+
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.db import connection, transaction
+
+from .caching import bump_user_orders_version_on_commit
+from .models import Order, Product
+
+
+def batched(rows: Iterable, size: int) -> Iterator[list]:
+    iterator = iter(rows)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def parse_product_ids(value: str) -> list[int]:
+    ids = [int(pid) for pid in value.split(',') if pid.strip()]
+    return list(dict.fromkeys(ids))
+
+
+def validate_orders(rows: Iterable[dict], batch_size: int = 1000) -> int:
+    """
+    Check the rows the way import_orders() does without writing anything.
+    Returns the number of rows, raises ValidationError listing every bad line.
+    """
+    count = 0
+    errors = []
+    for number, batch in enumerate(batched(rows, batch_size)):
+        errors.extend(_parse_batch(batch, first_line=number * batch_size + 2)[2])
+        count += len(batch)
+    if errors:
+        raise ValidationError(errors)
+    return count
+
+
+def import_orders(rows: Iterable[dict], batch_size: int = 1000, atomic: bool = True,
+                  progress: Callable[[int], None] | None = None) -> int:
+    """
+    Import orders from CSV rows (DictReader) in a single pass.
+    Each batch costs a fixed number of queries: one lookup for users,
+    one for products, one insert for orders, one for the M2M rows and
+    one update of the order totals.
+
+    With atomic=False every batch is committed on its own, so progress(imported),
+    called after each batch, is visible to other connections; run
+    validate_orders() first to keep a bad line from leaving a partial import.
+    """
+    imported = 0
+    with transaction.atomic() if atomic else nullcontext():
+        for number, batch in enumerate(batched(rows, batch_size)):
+            with transaction.atomic(savepoint=False):
+                imported += _import_batch(batch, first_line=number * batch_size + 2)
+            if progress is not None:
+                progress(imported)
+    return imported
+
+
+def _parse_batch(rows: list[dict], first_line: int) -> tuple[list[Order], list[tuple[int, list[int]]], list[str]]:
+    orders = []
+    products_per_order = []
+    errors = []
+    for line, row in enumerate(rows, start=first_line):
+        try:
+            user_id = int(row.get('user_id') or '')
+            product_ids = parse_product_ids(row.get('products') or '')
+        except ValueError:
+            errors.append(f'Line {line}: user_id and products must be integers')
+            continue
+        orders.append(Order(
+            delivery_address=row.get('delivery_address'),
+            promocode=row.get('promocode') or '',
+            user_id=user_id,
+        ))
+        products_per_order.append((line, product_ids))
+
+    user_ids = {order.user_id for order in orders}
+    product_ids = {pid for line, ids in products_per_order for pid in ids}
+    known_users = set(User.objects.filter(pk__in=user_ids).values_list('pk', flat=True))
+    known_products = set(Product.objects.filter(pk__in=product_ids).values_list('pk', flat=True))
+    for order, (line, ids) in zip(orders, products_per_order):
+        if order.user_id not in known_users:
+            errors.append(f'Line {line}: unknown user_id {order.user_id}')
+        missing = [pid for pid in ids if pid not in known_products]
+        if missing:
+            errors.append(f'Line {line}: unknown products {missing}')
+    return orders, products_per_order, errors
+
+
+def _import_batch(rows: list[dict], first_line: int) -> int:
+    orders, products_per_order, errors = _parse_batch(rows, first_line)
+    if errors:
+        raise ValidationError(errors)
+
+    if connection.features.can_return_rows_from_bulk_insert:
+        Order.objects.bulk_create(orders)
+    else:
+        for order in orders:
+            order.save()
+
+    through = Order.products.through
+    through.objects.bulk_create([
+        through(order_id=order.pk, product_id=pid)
+        for order, (line, ids) in zip(orders, products_per_order)
+        for pid in ids
+    ])
+    # bulk inserts bypass the Order signals
+    Order.objects.filter(pk__in=[order.pk for order in orders]).refresh_totals()
+    for user_id in {order.user_id for order in orders}:
+        bump_user_orders_version_on_commit(user_id, using=Order.objects.db)
+    return len(orders)
@@ -0,0 +1,187 @@
+import csv
+import logging
+import tempfile
+from contextlib import contextmanager
+from csv import DictReader
+from datetime import timedelta
+from io import TextIOWrapper
+from typing import Callable, Iterator
+
+from django.apps import apps
+from django.contrib import admin
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.core.files import File
+from django.db.models import QuerySet
+from django.db.models.functions import Coalesce
+from django.http import HttpRequest, QueryDict
+from django.utils import timezone
+
+from .importers import import_orders, validate_orders
+from .models import Job
+
+log = logging.getLogger(__name__)
+
+HANDLERS: dict[str, Callable[[Job], str]] = {}
+STALE_AFTER = timedelta(minutes=10)
+# kinds safe to run again from the start after their worker died
+RESTARTABLE_KINDS = {Job.Kind.EXPORT_CSV}
+
+
+def job_handler(kind: str):
+    """Register the function running jobs of this kind; it returns the job's final message."""
+    def register(func):
+        HANDLERS[kind] = func
+        return func
+    return register
+
+
+def enqueue(kind: str, params: dict | None = None, input_file: File | None = None,
+            user: User | None = None) -> Job:
+    job = Job(kind=kind, params=params or {}, created_by=user if user and user.is_authenticated else None)
+    if input_file is not None:
+        job.input_file.save(input_file.name, input_file, save=False)
+    job.save()
+    return job
+
+
+def report_progress(job: Job, processed: int, total: int | None = None) -> None:
+    """Saved right away, outside of any transaction the handler keeps open, for the admin to poll."""
+    job.processed = processed
+    values = {'processed': processed, 'heartbeat_at': timezone.now()}
+    if total is not None:
+        job.total = values['total'] = total
+    Job.objects.filter(pk=job.pk).update(**values)
+
+
+def release_stale_jobs(stale_after: timedelta = STALE_AFTER) -> int:
+    """
+    Running jobs without a heartbeat for stale_after lost their worker. Exports
+    start over; imports commit batch by batch, so they fail rather than run twice.
+    """
+    stale = Job.objects.alias(
+        last_seen=Coalesce('heartbeat_at', 'started_at'),
+    ).filter(status=Job.Status.RUNNING, last_seen__lt=timezone.now() - stale_after)
+    requeued = stale.filter(kind__in=RESTARTABLE_KINDS).update(
+        status=Job.Status.PENDING, started_at=None, heartbeat_at=None, processed=0,
+    )
+    failed = stale.update(
+        status=Job.Status.FAILED, finished_at=timezone.now(),
+        message='The worker running the job stopped, check what was imported before retrying',
+    )
+    return requeued + failed
+
+
+def claim_next_job() -> Job | None:
+    """
+    Take the oldest pending job. The conditional UPDATE makes the claim atomic,
+    so several runjobs workers never run the same job.
+    """
+    release_stale_jobs()
+    for pk in Job.objects.filter(status=Job.Status.PENDING).order_by('pk').values_list('pk', flat=True)[:10]:
+        now = timezone.now()
+        claimed = Job.objects.filter(pk=pk, status=Job.Status.PENDING).update(
+            status=Job.Status.RUNNING, started_at=now, heartbeat_at=now,
+        )
+        if claimed:
+            return Job.objects.get(pk=pk)
+    return None
+
+
+def run_job(job: Job) -> Job:
+    handler = HANDLERS.get(job.kind)
+    try:
+        if handler is None:
+            raise ValueError(f'No handler for jobs of kind {job.kind!r}')
+        message = handler(job)
+    except ValidationError as exc:
+        status, message = Job.Status.FAILED, '\n'.join(exc.messages)
+    except Exception as exc:
+        log.exception('Job %s failed', job.pk)
+        status, message = Job.Status.FAILED, f'{type(exc).__name__}: {exc}'
+    else:
+        status = Job.Status.DONE
+    Job.objects.filter(pk=job.pk).update(status=status, message=message, finished_at=timezone.now())
+    job.refresh_from_db()
+    return job
+
+
+def run_pending_jobs(limit: int | None = None) -> int:
+    done = 0
+    while limit is None or done < limit:
+        job = claim_next_job()
+        if job is None:
+            break
+        run_job(job)
+        done += 1
+    return done
+
+
+@contextmanager
+def open_csv_rows(job: Job) -> Iterator[DictReader]:
+    with job.input_file.open('rb') as file:
+        text = TextIOWrapper(file, encoding=job.params.get('encoding') or 'utf-8')
+        try:
+            yield DictReader(text)
+        finally:
+            text.detach()
+
+
+@job_handler(Job.Kind.IMPORT_ORDERS)
+def import_orders_job(job: Job) -> str:
+    batch_size = job.params.get('batch_size', 1000)
+    # the whole file is checked first, so committing batch by batch never leaves half an import
+    with open_csv_rows(job) as rows:
+        total = validate_orders(rows, batch_size=batch_size)
+    report_progress(job, 0, total)
+    with open_csv_rows(job) as rows:
+        imported = import_orders(
+            rows, batch_size=batch_size, atomic=False,
+            progress=lambda count: report_progress(job, count),
+        )
+    return f'Imported {imported} orders'
+
+
+def get_export_queryset(job: Job) -> QuerySet:
+    """
+    The rows picked in the admin: the checked primary keys (at most a page of
+    the changelist), or with "select all" the changelist filters replayed
+    through its ModelAdmin as the user who queued the export.
+    """
+    model = apps.get_model(job.params['model'])
+    if 'pks' in job.params:
+        return model._default_manager.filter(pk__in=job.params['pks'])
+    request = HttpRequest()
+    request.method = 'GET'
+    request.GET = QueryDict(job.params.get('changelist_filters', ''))
+    request.user = job.created_by
+    model_admin = admin.site.get_model_admin(model)
+    return model_admin.get_changelist_instance(request).get_queryset(request)
+
+
+@job_handler(Job.Kind.EXPORT_CSV)
+def export_csv_job(job: Job) -> str:
+    queryset = get_export_queryset(job).order_by()
+    meta = queryset.model._meta
+    chunk_size = job.params.get('chunk_size', 2000)
+    report_progress(job, 0, queryset.count())
+
+    # attname resolves foreign keys to their "<name>_id" column
+    columns = [field.attname for field in meta.fields]
+    pk_index = columns.index(meta.pk.attname)
+    rows = queryset.order_by('pk').values_list(*columns)
+    with tempfile.TemporaryFile('w+', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow([field.name for field in meta.fields])
+        written = 0
+        # keyset over pk: every chunk is a short query, however large the table
+        chunk = list(rows[:chunk_size])
+        while chunk:
+            writer.writerows(chunk)
+            written += len(chunk)
+            report_progress(job, written)
+            chunk = list(rows.filter(pk__gt=chunk[-1][pk_index])[:chunk_size])
+        file.seek(0)
+        job.result_file.save(f'{meta.model_name}-export-{job.pk}.csv', File(file), save=False)
+    Job.objects.filter(pk=job.pk).update(result_file=job.result_file.name)
+    return f'Exported {written} rows'
@@ -0,0 +1,138 @@
+import shutil
+import tempfile
+import uuid
+from statistics import quantiles
+from timeit import default_timer
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache, caches
+from django.core.cache.backends.redis import RedisCache
+from django.core.management import BaseCommand, CommandError
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from firstsite.cache_backends import TieredCache
+from shopapp.caching import user_orders_export_key
+from shopapp.models import Order
+
+# keys of the benchmark in Redis are deleted in batches of this size
+DELETE_BATCH_SIZE = 500
+
+
+class Command(BaseCommand):
+    help = 'Measure per-hit latency of the cached shop views for every cache tier'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, help='id of the user whose orders are exported')
+        parser.add_argument('--requests', type=int, default=200)
+        parser.add_argument(
+            '--tiers', nargs='+', default=['locmem', 'file', 'tiered'],
+            choices=['locmem', 'file', 'redis', 'tiered'],
+        )
+        parser.add_argument(
+            '--shared', default='file', choices=['file', 'redis'],
+            help='shared backend behind the tiered cache',
+        )
+
+    def get_backend(self, name: str) -> dict:
+        """
+        A cache of the benchmark only: its own locmem or temporary directory, or
+        a key prefix of its own in Redis, so the site's cache is not touched.
+        """
+        if name == 'locmem':
+            return {
+                'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                'LOCATION': 'cachebench',
+            }
+        if name == 'file':
+            return {
+                'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                'LOCATION': tempfile.mkdtemp(prefix='cachebench-'),
+            }
+        return {**settings.CACHE_BACKENDS['redis'], 'KEY_PREFIX': f'cachebench-{uuid.uuid4().hex}'}
+
+    def get_cache_settings(self, tier: str, shared: str) -> dict:
+        if tier == 'tiered':
+            return {
+                'default': {
+                    'BACKEND': 'firstsite.cache_backends.TieredCache',
+                    'LOCATION': 'shared',
+                    'OPTIONS': {'LOCAL_TIMEOUT': 5},
+                },
+                'shared': self.get_backend(shared),
+            }
+        return {'default': self.get_backend(tier)}
+
+    def delete_benchmark_keys(self, caches_setting: dict) -> None:
+        """Remove what the benchmark wrote, a Redis shared with the site keeps its other keys."""
+        for alias, params in caches_setting.items():
+            backend = caches[alias]
+            if isinstance(backend, RedisCache):
+                client = backend._cache.get_client(write=True)
+                keys = []
+                for key in client.scan_iter(match=f'{backend.key_prefix}:*', count=DELETE_BATCH_SIZE):
+                    keys.append(key)
+                    if len(keys) == DELETE_BATCH_SIZE:
+                        client.delete(*keys)
+                        keys = []
+                if keys:
+                    client.delete(*keys)
+            elif isinstance(backend, TieredCache):
+                backend.local.clear()
+            else:
+                backend.clear()
+                if params['BACKEND'].endswith('FileBasedCache'):
+                    shutil.rmtree(params['LOCATION'], ignore_errors=True)
+
+    def measure(self, func, count: int) -> tuple[float, float]:
+        timings = []
+        for _ in range(count):
+            started = default_timer()
+            func()
+            timings.append((default_timer() - started) * 1000)
+        percentiles = quantiles(timings, n=100)
+        return percentiles[49], percentiles[94]
+
+    def handle(self, *args, **options):
+        if options['user']:
+            user = User.objects.filter(pk=options['user']).first()
+        else:
+            user = User.objects.filter(pk__in=Order.objects.values('user_id')).first()
+        if user is None:
+            raise CommandError('No user with orders found, pass --user')
+
+        # the benchmark's requests are kept out of the site's request metrics
+        with tempfile.TemporaryDirectory(prefix='cachebench-metrics-') as metrics_dir:
+            with override_settings(METRICS_DIR=metrics_dir):
+                self.benchmark(user, options)
+        self.stdout.write(self.style.SUCCESS('Cache benchmark finished'))
+
+    def benchmark(self, user: User, options: dict) -> None:
+        client = Client(HTTP_USER_AGENT='cachebench')
+        client.force_login(user)
+        urls = {
+            'user_export': reverse('shopapp:user_export', kwargs={'user_id': user.pk}),
+            'user_order_list': reverse('shopapp:user_order_list', kwargs={'user_id': user.pk}),
+        }
+        count = options['requests']
+
+        self.stdout.write(f'{"tier":<10}{"target":<18}{"p50 ms":>10}{"p95 ms":>10}')
+        for tier in options['tiers']:
+            caches_setting = self.get_cache_settings(tier, options['shared'])
+            with override_settings(CACHES=caches_setting, ALLOWED_HOSTS=['testserver']):
+                try:
+                    cache.has_key('cachebench')
+                except Exception as exc:
+                    self.stdout.write(self.style.WARNING(f'{tier:<10}skipped: {exc}'))
+                    continue
+                try:
+                    for name, url in urls.items():
+                        client.get(url)
+                        p50, p95 = self.measure(lambda: client.get(url), count)
+                        self.stdout.write(f'{tier:<10}{name:<18}{p50:>10.3f}{p95:>10.3f}')
+                    key = user_orders_export_key(user.pk)
+                    p50, p95 = self.measure(lambda: cache.get(key), count)
+                    self.stdout.write(f'{tier:<10}{"cache.get":<18}{p50:>10.3f}{p95:>10.3f}')
+                finally:
+                    self.delete_benchmark_keys(caches_setting)
@@ -0,0 +1,83 @@
+import shutil
+import tempfile
+from multiprocessing import get_context
+from pathlib import Path
+from timeit import default_timer
+
+from django.core.management import BaseCommand
+from django.db import OperationalError, connection, connections, transaction
+
+# a copy of the configured database settings pointing to a throwaway database
+BENCH_ALIAS = 'dbbench'
+BENCH_TABLE = 'dbbench_row'
+
+
+def write_rows(worker: int, count: int) -> tuple[int, int]:
+    connections.close_all()
+    bench = connections[BENCH_ALIAS]
+    written = failed = 0
+    for number in range(count):
+        try:
+            with transaction.atomic(using=BENCH_ALIAS), bench.cursor() as cursor:
+                cursor.execute(f'INSERT INTO {BENCH_TABLE} (worker, payload) VALUES (%s, %s)', [worker, f'row {number}'])
+                # read-modify-write, the pattern that hits "database is locked" on SQLite
+                cursor.execute(f'SELECT COUNT(*) FROM {BENCH_TABLE} WHERE worker = %s', [worker])
+            written += 1
+        except OperationalError:
+            failed += 1
+    connections.close_all()
+    return written, failed
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure how write throughput of the configured database engine and options scales with '
+        'concurrent workers. Runs in a throwaway database that is dropped afterwards.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+        parser.add_argument('--writes', type=int, default=200, help='write transactions per worker')
+
+    def create_database(self) -> None:
+        settings_dict = {**connection.settings_dict}
+        if connection.vendor == 'sqlite':
+            self.directory = tempfile.mkdtemp(prefix='dbbench-')
+            settings_dict['NAME'] = str(Path(self.directory) / 'dbbench.sqlite3')
+        else:
+            settings_dict['NAME'] = f'{settings_dict["NAME"]}_dbbench'
+            with connection._nodb_cursor() as cursor:
+                cursor.execute(f'CREATE DATABASE {connection.ops.quote_name(settings_dict["NAME"])}')
+        connections.settings[BENCH_ALIAS] = settings_dict
+        with connections[BENCH_ALIAS].cursor() as cursor:
+            cursor.execute(f'CREATE TABLE {BENCH_TABLE} (worker integer NOT NULL, payload varchar(100) NOT NULL)')
+        connections.close_all()
+
+    def drop_database(self) -> None:
+        name = connections[BENCH_ALIAS].settings_dict['NAME']
+        connections[BENCH_ALIAS].close()
+        del connections[BENCH_ALIAS]
+        del connections.settings[BENCH_ALIAS]
+        if connection.vendor == 'sqlite':
+            shutil.rmtree(self.directory, ignore_errors=True)
+        else:
+            with connection._nodb_cursor() as cursor:
+                cursor.execute(f'DROP DATABASE {connection.ops.quote_name(name)}')
+
+    def handle(self, *args, **options):
+        self.create_database()
+        try:
+            self.stdout.write(f'database: {connection.vendor} {connections[BENCH_ALIAS].settings_dict["NAME"]}')
+            self.stdout.write(f'{"workers":>8}{"writes/s":>12}{"failed":>8}{"seconds":>10}')
+            fork = get_context('fork')
+            for workers in options['workers']:
+                started = default_timer()
+                with fork.Pool(workers) as pool:
+                    results = pool.starmap(write_rows, [(worker, options['writes']) for worker in range(workers)])
+                elapsed = default_timer() - started
+                written = sum(result[0] for result in results)
+                failed = sum(result[1] for result in results)
+                self.stdout.write(f'{workers:>8}{written / elapsed:>12.1f}{failed:>8}{elapsed:>10.2f}')
+        finally:
+            self.drop_database()
+        self.stdout.write(self.style.SUCCESS('Database benchmark finished'))
@@ -0,0 +1,68 @@
+from concurrent.futures import ThreadPoolExecutor
+from itertools import cycle, islice
+from statistics import quantiles
+from timeit import default_timer
+from urllib.error import URLError
+from urllib.request import urlopen
+
+from django.core.management import BaseCommand
+
+from shopapp.models import Product
+
+
+class Command(BaseCommand):
+    help = (
+        'Load test running servers and compare their throughput, '
+        'e.g. gunicorn in wsgi mode on :8000 against asgi mode on :8001'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('targets', nargs='+', help='base urls, e.g. http://127.0.0.1:8000')
+        parser.add_argument('--paths', nargs='+', help='paths to request, defaults to the read-only shop pages')
+        parser.add_argument('--requests', type=int, default=1000)
+        parser.add_argument('--concurrency', type=int, default=32)
+
+    def get_default_paths(self) -> list[str]:
+        paths = ['/en/shop/products/', '/en/shop/products/latest/feed/']
+        product = Product.objects.filter(archived=False).only('pk').first()
+        if product:
+            paths.append(f'/en/shop/products/{product.pk}/')
+        return paths
+
+    @staticmethod
+    def fetch(url: str) -> tuple[float, bool]:
+        started = default_timer()
+        try:
+            with urlopen(url, timeout=30) as response:
+                response.read()
+                ok = response.status < 400
+        except (URLError, OSError):
+            ok = False
+        return default_timer() - started, ok
+
+    def run(self, target: str, paths: list[str], count: int, concurrency: int) -> dict:
+        urls = [target.rstrip('/') + path for path in islice(cycle(paths), count)]
+        started = default_timer()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            results = list(executor.map(self.fetch, urls))
+        elapsed = default_timer() - started
+        timings = sorted(timing * 1000 for timing, ok in results)
+        percentiles = quantiles(timings, n=100)
+        return {
+            'rps': count / elapsed,
+            'p50': percentiles[49],
+            'p95': percentiles[94],
+            'errors': sum(1 for timing, ok in results if not ok),
+        }
+
+    def handle(self, *args, **options):
+        paths = options['paths'] or self.get_default_paths()
+        self.stdout.write(f'paths: {", ".join(paths)}')
+        self.stdout.write(f'{"target":<32}{"req/s":>10}{"p50 ms":>10}{"p95 ms":>10}{"errors":>8}')
+        for target in options['targets']:
+            result = self.run(target, paths, options['requests'], options['concurrency'])
+            self.stdout.write(
+                f'{target:<32}{result["rps"]:>10.1f}{result["p50"]:>10.2f}'
+                f'{result["p95"]:>10.2f}{result["errors"]:>8}'
+            )
+        self.stdout.write(self.style.SUCCESS('Load test finished'))
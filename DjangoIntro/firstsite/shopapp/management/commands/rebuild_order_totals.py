@@ -0,0 +1,19 @@
+from django.core.management import BaseCommand
+from django.db.models import Max
+
+from shopapp.models import Order
+
+
+class Command(BaseCommand):
+    help = 'Recompute product_count, total_price and total_discounted_price of all orders'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        last_pk = Order.objects.aggregate(last_pk=Max('pk'))['last_pk'] or 0
+        updated = 0
+        for start in range(0, last_pk, batch_size):
+            updated += Order.objects.filter(pk__gt=start, pk__lte=start + batch_size).refresh_totals()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt totals of {updated} orders'))
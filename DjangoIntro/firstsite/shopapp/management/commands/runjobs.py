@@ -0,0 +1,28 @@
+import time
+
+from django.core.management import BaseCommand
+from django.db import close_old_connections
+
+from shopapp.jobs import claim_next_job, run_job
+
+
+class Command(BaseCommand):
+    help = 'Run the queued background jobs (CSV imports and exports), polling the database for new ones'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='run the pending jobs and exit')
+        parser.add_argument('--interval', type=float, default=2.0, help='seconds between polls when idle')
+
+    def handle(self, *args, **options):
+        while True:
+            close_old_connections()
+            job = claim_next_job()
+            if job is None:
+                if options['once']:
+                    break
+                time.sleep(options['interval'])
+                continue
+            self.stdout.write(f'Running job #{job.pk} ({job.kind})')
+            job = run_job(job)
+            style = self.style.SUCCESS if job.status == job.Status.DONE else self.style.ERROR
+            self.stdout.write(style(f'Job #{job.pk} {job.status}: {job.message}'))
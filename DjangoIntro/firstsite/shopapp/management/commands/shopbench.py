@@ -0,0 +1,235 @@
+import json
+import random
+import subprocess
+import tempfile
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+from statistics import mean, quantiles
+from timeit import default_timer
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from shopapp.caching import bump_catalog_state, bump_user_orders_version
+from shopapp.models import Order, Product
+
+# rows are written and removed in transactions of this size, so other
+# writers of the database wait at most one batch (SQLite locks it as a whole)
+BATCH_SIZE = 1000
+
+
+class Command(BaseCommand):
+    help = (
+        'Seed a synthetic shop and measure latency, queries and peak memory of the main '
+        'endpoints in-process. Results are written as JSON to compare between commits.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=20)
+        parser.add_argument('--products', type=int, default=500)
+        parser.add_argument('--orders', type=int, default=1000)
+        parser.add_argument('--products-per-order', type=int, default=3, help='M2M density')
+        parser.add_argument('--requests', type=int, default=50, help='requests per endpoint')
+        parser.add_argument('--cold', action='store_true', help='clear the cache before every request')
+        parser.add_argument('--keep', action='store_true', help='keep the seeded data instead of removing it')
+        parser.add_argument('--output', help='result file, defaults to var/bench/shopbench-<time>.json')
+        parser.add_argument('--compare', help='earlier result file to print the difference against')
+        parser.add_argument('--seed', type=int, default=42)
+
+    @staticmethod
+    def create(model, objs: list) -> list:
+        for start in range(0, len(objs), BATCH_SIZE):
+            model.objects.bulk_create(objs[start:start + BATCH_SIZE])
+        return objs
+
+    def seed(self, options) -> list[User]:
+        rng = random.Random(options['seed'])
+        prefix = f'bench{rng.randrange(10 ** 6)}'
+        users = self.create(User, [
+            User(username=f'{prefix}_user{i}', is_staff=i == 0, is_superuser=i == 0)
+            for i in range(max(options['users'], 1))
+        ])
+        products = self.create(Product, [
+            Product(
+                name=f'{prefix} product {i}',
+                description=f'Synthetic product number {i}',
+                price=rng.randint(1, 9999),
+                discount=rng.choice((0, 0, 5, 10, 25)),
+                author=rng.choice(users),
+            )
+            for i in range(options['products'])
+        ])
+        orders = self.create(Order, [
+            Order(delivery_address=f'{prefix} street {i}', promocode='BENCH', user=rng.choice(users))
+            for i in range(options['orders'])
+        ])
+        per_order = min(options['products_per_order'], len(products))
+        self.create(Order.products.through, [
+            Order.products.through(order_id=order.pk, product_id=product.pk)
+            for order in orders
+            for product in rng.sample(products, per_order)
+        ])
+        for start in range(0, len(orders), BATCH_SIZE):
+            Order.objects.filter(pk__in=[order.pk for order in orders[start:start + BATCH_SIZE]]).refresh_totals()
+        bump_catalog_state()
+        return users
+
+    def remove(self, users: list[User]) -> None:
+        user_ids = [user.pk for user in users]
+        # orders protect their users, the users' products go with them
+        for model, lookup in ((Order, 'user_id__in'), (Product, 'author_id__in'), (User, 'pk__in')):
+            queryset = model.objects.filter(**{lookup: user_ids})
+            while pks := list(queryset.values_list('pk', flat=True)[:BATCH_SIZE]):
+                model.objects.filter(pk__in=pks).delete()
+        # the ids of the removed rows may be reused, so nothing cached for them may survive
+        for user_id in user_ids:
+            bump_user_orders_version(user_id)
+        bump_catalog_state()
+
+    def get_endpoints(self, user: User) -> dict[str, str]:
+        product = Product.objects.filter(archived=False).order_by('-pk').only('pk').first()
+        owner_id = Order.objects.order_by('-pk').values_list('user_id', flat=True).first() or user.pk
+        endpoints = {
+            'products_list': reverse('shopapp:products_list'),
+            'orders_list': reverse('shopapp:orders_list'),
+            'api_products': reverse('shopapp:product-list'),
+            'api_orders': reverse('shopapp:order-list'),
+            'orders_export': reverse('shopapp:order_export'),
+            'user_orders_export': reverse('shopapp:user_export', kwargs={'user_id': owner_id}),
+            'latest_feed': reverse('shopapp:latest_feed'),
+            'sitemap': reverse('django.contrib.sitemaps.views.sitemap'),
+        }
+        if product:
+            endpoints['product_details'] = reverse('shopapp:product_details', kwargs={'pk': product.pk})
+        return endpoints
+
+    @staticmethod
+    def fetch(client: Client, url: str) -> int:
+        response = client.get(url)
+        if response.streaming:
+            b''.join(response.streaming_content)
+        return response.status_code
+
+    def measure(self, client: Client, url: str, count: int, cold: bool) -> dict:
+        timings = []
+        query_counts = []
+        status = None
+        for _ in range(count):
+            if cold:
+                cache.clear()
+            with CaptureQueriesContext(connection) as queries:
+                started = default_timer()
+                status = self.fetch(client, url)
+                timings.append((default_timer() - started) * 1000)
+            query_counts.append(len(queries))
+
+        # tracing slows everything down, so peak memory gets a request of its own
+        if cold:
+            cache.clear()
+        tracemalloc.start()
+        try:
+            self.fetch(client, url)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+        percentiles = quantiles(timings, n=100) if len(timings) > 1 else timings * 99
+        return {
+            'url': url,
+            'status': status,
+            'p50_ms': round(percentiles[49], 3),
+            'p95_ms': round(percentiles[94], 3),
+            'p99_ms': round(percentiles[98], 3),
+            'mean_ms': round(mean(timings), 3),
+            'queries': max(query_counts),
+            'peak_memory_kb': round(peak / 1024, 1),
+        }
+
+    @staticmethod
+    def get_revision() -> str | None:
+        try:
+            result = subprocess.run(
+                ['git', 'rev-parse', '--short', 'HEAD'],
+                cwd=settings.BASE_DIR, capture_output=True, text=True, check=True,
+            )
+        except (OSError, subprocess.CalledProcessError):
+            return None
+        return result.stdout.strip()
+
+    def run(self, options) -> dict:
+        started = default_timer()
+        users = self.seed(options)
+        user = users[0]
+        seed_seconds = default_timer() - started
+        self.stdout.write(f'seeded in {seed_seconds:.2f}s')
+
+        try:
+            client = Client(HTTP_USER_AGENT='shopbench')
+            client.force_login(user)
+            endpoints = {}
+            for name, url in self.get_endpoints(user).items():
+                result = endpoints[name] = self.measure(client, url, options['requests'], options['cold'])
+                self.stdout.write(
+                    f'{name:<20}{result["status"]:>7}{result["p50_ms"]:>10.2f}{result["p95_ms"]:>10.2f}'
+                    f'{result["p99_ms"]:>10.2f}{result["queries"]:>9}{result["peak_memory_kb"]:>12.1f}'
+                )
+        finally:
+            if not options['keep']:
+                self.remove(users)
+
+        return {
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'revision': self.get_revision(),
+            'database': connection.vendor,
+            'cache': settings.CACHES['default']['BACKEND'],
+            'dataset': {
+                name: options[name]
+                for name in ('users', 'products', 'orders', 'products_per_order', 'requests', 'cold', 'seed')
+            },
+            'seed_seconds': round(seed_seconds, 3),
+            'endpoints': endpoints,
+        }
+
+    def compare(self, result: dict, path: str) -> None:
+        try:
+            baseline = json.loads(Path(path).read_text())
+        except (OSError, ValueError) as exc:
+            raise CommandError(f'Cannot read {path}: {exc}')
+        self.stdout.write(f'compared with {path} ({baseline.get("revision")})')
+        self.stdout.write(f'{"endpoint":<20}{"p95 ms":>18}{"queries":>12}')
+        for name, current in result['endpoints'].items():
+            previous = baseline['endpoints'].get(name)
+            if previous is None:
+                continue
+            change = (current['p95_ms'] - previous['p95_ms']) / previous['p95_ms'] * 100 if previous['p95_ms'] else 0
+            self.stdout.write(
+                f'{name:<20}{previous["p95_ms"]:>8.2f} {change:>+8.1f}%'
+                f'{previous["queries"]:>6} -> {current["queries"]:<4}'
+            )
+
+    def handle(self, *args, **options):
+        toolbar_config = {**getattr(settings, 'DEBUG_TOOLBAR_CONFIG', {}), 'SHOW_TOOLBAR_CALLBACK': lambda request: False}
+        self.stdout.write(
+            f'{"endpoint":<20}{"status":>7}{"p50 ms":>10}{"p95 ms":>10}{"p99 ms":>10}{"queries":>9}{"peak KiB":>12}'
+        )
+        # the benchmark's requests are kept out of the site's request metrics
+        with tempfile.TemporaryDirectory(prefix='shopbench-metrics-') as metrics_dir:
+            with override_settings(
+                ALLOWED_HOSTS=['testserver'], DEBUG_TOOLBAR_CONFIG=toolbar_config, METRICS_DIR=metrics_dir,
+            ):
+                result = self.run(options)
+
+        output = Path(options['output'] or settings.BASE_DIR / 'var/bench' / f'shopbench-{datetime.now():%Y%m%d-%H%M%S}.json')
+        output.parent.mkdir(parents=True, exist_ok=True)
+        output.write_text(json.dumps(result, indent=2))
+        self.stdout.write(f'results written to {output}')
+        if options['compare']:
+            self.compare(result, options['compare'])
+        self.stdout.write(self.style.SUCCESS('Shop benchmark finished'))
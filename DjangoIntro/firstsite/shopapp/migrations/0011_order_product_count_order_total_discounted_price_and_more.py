@@ -0,0 +1,57 @@
+# Generated by Django 5.2.4 on 2026-10-18 18:09
+
+from django.db import migrations, models
+from django.db.models import Count, ExpressionWrapper, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def fill_order_totals(apps, schema_editor):
+    Order = apps.get_model('shopapp', 'Order')
+    items = (
+        Order.products.through.objects
+        .filter(order_id=OuterRef('pk'))
+        .order_by()
+        .values('order_id')
+    )
+    money = models.DecimalField(max_digits=12, decimal_places=2)
+    discounted_price = ExpressionWrapper(
+        F('product__price') * (100 - F('product__discount')) / 100.0,
+        output_field=money,
+    )
+    Order.objects.update(
+        product_count=Coalesce(Subquery(items.annotate(value=Count('pk')).values('value')), 0),
+        total_price=Coalesce(
+            Subquery(items.annotate(value=Sum('product__price')).values('value'), output_field=money),
+            Value(0, output_field=money),
+        ),
+        total_discounted_price=Coalesce(
+            Subquery(items.annotate(value=Sum(discounted_price)).values('value'), output_field=money),
+            Value(0, output_field=money),
+        ),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopapp', '0010_alter_order_options_alter_product_options_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='product_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='total_discounted_price',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='total_price',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=12),
+        ),
+        migrations.RunPython(fill_order_totals, migrations.RunPython.noop),
+    ]
@@ -1,8 +1,12 @@
 from django.contrib.auth.models import User
 from django.db import models
+from django.db.models import Count, ExpressionWrapper, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
 from django.urls import reverse
 from django.utils.translation import gettext_lazy as _, ngettext
 
+from .caching import bump_user_orders_version_on_commit
+
 # Create your models here.
 from django.db import models
 from django.contrib.auth.models import User
@@ -14,6 +18,17 @@ class Product(models.Model):
         ordering = ["name", "price"]
         verbose_name = _('Product')
         verbose_name_plural = _('Products')
+        indexes = [
+            # products list: filter(archived=False) in Meta.ordering. A partial index, since
+            # SQLite compiles the filter to NOT archived, which no (archived, ...) index can seek
+            models.Index(
+                fields=['name', 'price'],
+                condition=models.Q(archived=False),
+                name='product_active_name_price_idx',
+            ),
+            # latest feed and sitemap: order_by('-created_at')
+            models.Index(fields=['-created_at'], name='product_created_at_desc_idx'),
+        ]
 
     name = models.CharField(max_length=100)
     description = models.TextField(null=False, blank=True)
@@ -26,24 +41,154 @@ class Product(models.Model):
         verbose_name=_('Author')
     )
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
     archived = models.BooleanField(default=False)
+    # bumped on every save, part of the product page ETag
+    revision = models.PositiveIntegerField(default=0, editable=False)
 
     def __str__(self) -> str:
         return f'Product(pk={self.pk}, name={self.name!r})'
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_pricing = instance.pricing
+        return instance
+
+    @property
+    def pricing(self) -> tuple:
+        """Price and discount as loaded, None for a deferred field."""
+        return self.__dict__.get('price'), self.__dict__.get('discount')
+
+    def save(self, *args, **kwargs):
+        adding = self._state.adding or self.pk is None
+        # incremented by the database, so concurrent saves never share a revision (and an ETag)
+        self.revision = 1 if adding else F('revision') + 1
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = {*kwargs['update_fields'], 'revision', 'updated_at'}
+        super().save(*args, **kwargs)
+        if not adding:
+            self.refresh_from_db(fields=['revision'])
+
     def get_absolute_url(self):
         return reverse('shopapp:product_details', kwargs={'pk': self.pk})
 
+class OrderQuerySet(models.QuerySet):
+    def refresh_totals(self) -> int:
+        """
+        Recompute the denormalized totals of the orders with one UPDATE and
+        retire the cached order pages and exports of their owners.
+        """
+        user_ids = set(self.order_by().values_list('user_id', flat=True).distinct())
+        items = (
+            Order.products.through.objects
+            .filter(order_id=OuterRef('pk'))
+            .order_by()
+            .values('order_id')
+        )
+        money = models.DecimalField(max_digits=12, decimal_places=2)
+        discounted_price = ExpressionWrapper(
+            F('product__price') * (100 - F('product__discount')) / 100.0,
+            output_field=money,
+        )
+        updated = self.update(
+            product_count=Coalesce(Subquery(items.annotate(value=Count('pk')).values('value')), 0),
+            total_price=Coalesce(
+                Subquery(items.annotate(value=Sum('product__price')).values('value'), output_field=money),
+                Value(0, output_field=money),
+            ),
+            total_discounted_price=Coalesce(
+                Subquery(items.annotate(value=Sum(discounted_price)).values('value'), output_field=money),
+                Value(0, output_field=money),
+            ),
+        )
+        for user_id in user_ids:
+            bump_user_orders_version_on_commit(user_id, using=self.db)
+        return updated
+
+
 class Order(models.Model):
+    TOTAL_FIELDS = ('product_count', 'total_price', 'total_discounted_price')
+
     class Meta:
         verbose_name = _('Order')
         verbose_name_plural = _('Orders')
+        indexes = [
+            # OrderViewSet filters: user with created_at or promocode
+            models.Index(fields=['user', 'created_at'], name='order_user_created_at_idx'),
+            models.Index(fields=['user', 'promocode'], name='order_user_promocode_idx'),
+            models.Index(fields=['created_at'], name='order_created_at_idx'),
+        ]
 
     delivery_address = models.TextField(null=True, blank=True)
     promocode = models.CharField(max_length=20, null=False, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
-    user = models.ForeignKey(User, on_delete=models.PROTECT)
+    # order_user_created_at_idx starts with user_id and serves the FK lookups too
+    user = models.ForeignKey(User, on_delete=models.PROTECT, db_index=False)
     products = models.ManyToManyField(Product, related_name="orders")
+    product_count = models.PositiveIntegerField(default=0, editable=False)
+    total_price = models.DecimalField(default=0, max_digits=12, decimal_places=2, editable=False)
+    total_discounted_price = models.DecimalField(default=0, max_digits=12, decimal_places=2, editable=False)
+
+    objects = OrderQuerySet.as_manager()
 
     def __str__(self):
         return f"Order(pk={self.pk}, user={self.user})"
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # the owner as loaded, so a save that moves the order retires both users' caches
+        instance._loaded_user_id = instance.__dict__.get('user_id')
+        return instance
+
+
+class Job(models.Model):
+    """Bulk data work queued by the admin and run by `manage.py runjobs`."""
+    class Kind(models.TextChoices):
+        IMPORT_ORDERS = 'import_orders', _('Import orders from CSV')
+        EXPORT_CSV = 'export_csv', _('Export to CSV')
+
+    class Status(models.TextChoices):
+        PENDING = 'pending', _('Pending')
+        RUNNING = 'running', _('Running')
+        DONE = 'done', _('Done')
+        FAILED = 'failed', _('Failed')
+
+    class Meta:
+        verbose_name = _('Job')
+        verbose_name_plural = _('Jobs')
+        indexes = [
+            # runjobs: oldest pending job first
+            models.Index(fields=['status', 'id'], name='job_status_idx'),
+        ]
+
+    kind = models.CharField(max_length=30, choices=Kind.choices)
+    status = models.CharField(max_length=10, choices=Status.choices, default=Status.PENDING)
+    params = models.JSONField(default=dict, blank=True)
+    input_file = models.FileField(upload_to='jobs/input/', blank=True)
+    result_file = models.FileField(upload_to='jobs/results/', blank=True)
+    processed = models.PositiveIntegerField(default=0)
+    total = models.PositiveIntegerField(null=True, blank=True)
+    message = models.TextField(blank=True)
+    created_by = models.ForeignKey(User, null=True, blank=True, on_delete=models.SET_NULL, related_name='+')
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    # touched with every progress report, a running job that stops touching it lost its worker
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self) -> str:
+        return f'Job(pk={self.pk}, kind={self.kind!r}, status={self.status!r})'
+
+    @property
+    def percent(self) -> int | None:
+        if self.status == self.Status.DONE:
+            return 100
+        if not self.total:
+            return None
+        return min(100, self.processed * 100 // self.total)
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (self.Status.DONE, self.Status.FAILED)
@@ -0,0 +1,182 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from binascii import Error as BinasciiError
+from dataclasses import dataclass
+from hashlib import md5
+from typing import Sequence
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q, QuerySet
+from django.http import Http404
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class CreatedAtCursorPagination(CursorPagination):
+    ordering = ('-created_at', '-pk')
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+
+class ShopPagination(PageNumberPagination):
+    """
+    Page number pagination by default. ?pagination=cursor (or a ?cursor= from
+    a previous page) switches to keyset pagination over (created_at, pk), and
+    ?count=false skips the COUNT(*) query of page number pagination.
+    """
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    cursor_class = CreatedAtCursorPagination
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.cursor_paginator = None
+        self.counted = True
+        if request.query_params.get('pagination') == 'cursor' or 'cursor' in request.query_params:
+            self.cursor_paginator = self.cursor_class()
+            return self.cursor_paginator.paginate_queryset(queryset, request, view)
+        if request.query_params.get('count') in ('false', '0'):
+            self.counted = False
+            return self.paginate_without_count(queryset, request)
+        return super().paginate_queryset(queryset, request, view)
+
+    def paginate_without_count(self, queryset, request):
+        self.request = request
+        page_size = self.get_page_size(request)
+        try:
+            self.page_number = int(request.query_params.get(self.page_query_param, 1))
+        except ValueError:
+            raise NotFound(self.invalid_page_message)
+        if self.page_number < 1:
+            raise NotFound(self.invalid_page_message)
+        offset = (self.page_number - 1) * page_size
+        rows = list(queryset[offset:offset + page_size + 1])
+        self.has_next = len(rows) > page_size
+        return rows[:page_size]
+
+    def get_next_link(self):
+        if self.counted:
+            return super().get_next_link()
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.page_query_param, self.page_number + 1)
+
+    def get_previous_link(self):
+        if self.counted:
+            return super().get_previous_link()
+        if self.page_number <= 1:
+            return None
+        url = self.request.build_absolute_uri()
+        if self.page_number == 2:
+            return remove_query_param(url, self.page_query_param)
+        return replace_query_param(url, self.page_query_param, self.page_number - 1)
+
+    def get_paginated_response(self, data):
+        if self.cursor_paginator is not None:
+            return self.cursor_paginator.get_paginated_response(data)
+        if not self.counted:
+            return Response({
+                'next': self.get_next_link(),
+                'previous': self.get_previous_link(),
+                'results': data,
+            })
+        return super().get_paginated_response(data)
+
+
+@dataclass
+class KeysetPage:
+    keys: list
+    object_list: QuerySet
+    next_cursor: str | None
+    previous_cursor: str | None
+    version: str
+
+
+class KeysetPaginator:
+    """
+    Keyset pagination for template views. A page is found with a WHERE on the
+    ordering columns of the neighbouring row instead of an OFFSET, so deep
+    pages cost the same as the first one. Only the keys are fetched up front:
+    object_list is a lazy queryset, left unevaluated when the page comes from
+    a fragment cache keyed on the page version (its keys and the max of
+    version_field).
+
+    ordering is ascending and its last field must be unique.
+    """
+
+    def __init__(self, queryset: QuerySet, ordering: Sequence[str], per_page: int,
+                 version_field: str | None = None):
+        self.queryset = queryset
+        self.ordering = tuple(ordering)
+        self.per_page = per_page
+        self.version_field = version_field
+
+    @staticmethod
+    def encode_cursor(values: Sequence, direction: str) -> str:
+        data = json.dumps([direction, list(values)], cls=DjangoJSONEncoder)
+        return urlsafe_b64encode(data.encode()).decode()
+
+    @staticmethod
+    def decode_cursor(cursor: str) -> tuple[str, list]:
+        try:
+            direction, values = json.loads(urlsafe_b64decode(cursor.encode()))
+        except (BinasciiError, ValueError, TypeError):
+            raise Http404('Invalid cursor')
+        if direction not in ('next', 'previous') or not isinstance(values, list):
+            raise Http404('Invalid cursor')
+        return direction, values
+
+    def get_keys_queryset(self, cursor: str | None) -> tuple[QuerySet, bool]:
+        """Keys of the page plus one extra row, and whether they come in reverse order."""
+        fields = list(self.ordering)
+        if self.version_field:
+            fields.append(self.version_field)
+        queryset = self.queryset.order_by(*self.ordering)
+        backwards = False
+        if cursor:
+            direction, values = self.decode_cursor(cursor)
+            if len(values) != len(self.ordering):
+                raise Http404('Invalid cursor')
+            backwards = direction == 'previous'
+            queryset = queryset.filter(self.get_keyset_filter(values, 'lt' if backwards else 'gt'))
+            if backwards:
+                queryset = queryset.reverse()
+        return queryset.values_list(*fields)[:self.per_page + 1], backwards
+
+    def get_keyset_filter(self, values: Sequence, lookup: str) -> Q:
+        # (a, b, c) > (x, y, z)  <=>  a > x OR (a = x AND b > y) OR (a = x AND b = y AND c > z)
+        condition = Q()
+        for index, field in enumerate(self.ordering):
+            equal = {name: value for name, value in zip(self.ordering[:index], values)}
+            condition |= Q(**equal, **{f'{field}__{lookup}': values[index]})
+        return condition
+
+    def build_page(self, rows: list, cursor: str | None, backwards: bool) -> KeysetPage:
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if backwards:
+            rows.reverse()
+        size = len(self.ordering)
+        has_next = has_more or backwards
+        has_previous = has_more if backwards else cursor is not None
+        next_cursor = self.encode_cursor(rows[-1][:size], 'next') if rows and has_next else None
+        previous_cursor = self.encode_cursor(rows[0][:size], 'previous') if rows and has_previous else None
+
+        pk_index = size - 1
+        keys = [row[pk_index] for row in rows]
+        version = md5(repr(keys).encode(), usedforsecurity=False).hexdigest()
+        if self.version_field and rows:
+            latest = max(row[size] for row in rows)
+            version = f'{latest.timestamp()}_{version}'
+        object_list = self.queryset.filter(**{f'{self.ordering[-1]}__in': keys}).order_by(*self.ordering)
+        return KeysetPage(keys, object_list, next_cursor, previous_cursor, version)
+
+    def page(self, cursor: str | None) -> KeysetPage:
+        queryset, backwards = self.get_keys_queryset(cursor)
+        return self.build_page(list(queryset), cursor, backwards)
+
+    async def apage(self, cursor: str | None) -> KeysetPage:
+        queryset, backwards = self.get_keys_queryset(cursor)
+        return self.build_page([row async for row in queryset], cursor, backwards)
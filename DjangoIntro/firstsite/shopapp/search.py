@@ -0,0 +1,162 @@
+import re
+
+from django.conf import settings
+from django.db import connections, DEFAULT_DB_ALIAS
+from django.db.models import Q, QuerySet
+from django.utils.module_loading import import_string
+from rest_framework.filters import BaseFilterBackend
+
+from .models import Product
+
+TOKEN_RE = re.compile(r'\w+')
+MAX_TOKENS = 10
+
+
+def tokenize(query: str) -> list[str]:
+    return TOKEN_RE.findall(query)[:MAX_TOKENS]
+
+
+class ProductSearchBackend:
+    """Substring search over name and description, for databases without full-text search."""
+    def __init__(self, connection):
+        self.connection = connection
+        self.table = Product._meta.db_table
+
+    def install(self) -> None:
+        """Create the database objects the backend needs, idempotent."""
+
+    def search(self, queryset: QuerySet, query: str) -> QuerySet:
+        for token in tokenize(query):
+            queryset = queryset.filter(Q(name__icontains=token) | Q(description__icontains=token))
+        return queryset
+
+
+class SQLiteFTSBackend(ProductSearchBackend):
+    """
+    FTS5 index over name and description. The virtual table reads its content
+    from the product table and is kept in sync by triggers; matches are ranked
+    with bm25, name weighted over description.
+    """
+    def __init__(self, connection):
+        super().__init__(connection)
+        self.fts_table = f'{self.table}_fts'
+
+    def install(self) -> None:
+        table, fts = self.table, self.fts_table
+        with self.connection.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [fts])
+            created = cursor.fetchone() is None
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5("
+                f"name, description, content='{table}', content_rowid='id', "
+                f"tokenize='unicode61 remove_diacritics 2')"
+            )
+            # table rebuilds in migrations drop triggers, so they are recreated every time
+            cursor.execute(
+                f"CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} BEGIN "
+                f"INSERT INTO {fts}(rowid, name, description) VALUES (new.id, new.name, new.description); "
+                f"END"
+            )
+            cursor.execute(
+                f"CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} BEGIN "
+                f"INSERT INTO {fts}({fts}, rowid, name, description) "
+                f"VALUES ('delete', old.id, old.name, old.description); "
+                f"END"
+            )
+            cursor.execute(
+                f"CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF name, description ON {table} BEGIN "
+                f"INSERT INTO {fts}({fts}, rowid, name, description) "
+                f"VALUES ('delete', old.id, old.name, old.description); "
+                f"INSERT INTO {fts}(rowid, name, description) VALUES (new.id, new.name, new.description); "
+                f"END"
+            )
+            if created:
+                cursor.execute(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+
+    def search(self, queryset: QuerySet, query: str) -> QuerySet:
+        tokens = tokenize(query)
+        if not tokens:
+            return queryset
+        match = ' '.join(f'"{token}"*' for token in tokens)
+        return queryset.extra(
+            tables=[self.fts_table],
+            where=[f'{self.fts_table}.rowid = {self.table}.id', f'{self.fts_table} MATCH %s'],
+            params=[match],
+            select={'search_rank': f'bm25({self.fts_table}, 10.0, 1.0)'},
+        ).order_by('search_rank')
+
+
+class PostgresSearchBackend(ProductSearchBackend):
+    """
+    Stored generated tsvector column with a GIN index, ranked with ts_rank.
+    The column is maintained by PostgreSQL itself, so no signals are needed.
+    """
+    config = 'simple'
+
+    def install(self) -> None:
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                f"ALTER TABLE {self.table} ADD COLUMN IF NOT EXISTS search_vector tsvector "
+                f"GENERATED ALWAYS AS ("
+                f"setweight(to_tsvector('{self.config}', coalesce(name, '')), 'A') || "
+                f"setweight(to_tsvector('{self.config}', coalesce(description, '')), 'B')"
+                f") STORED"
+            )
+            cursor.execute(
+                f"CREATE INDEX IF NOT EXISTS {self.table}_search_idx ON {self.table} USING gin (search_vector)"
+            )
+
+    def search(self, queryset: QuerySet, query: str) -> QuerySet:
+        tokens = tokenize(query)
+        if not tokens:
+            return queryset
+        tsquery = ' & '.join(f'{token}:*' for token in tokens)
+        return queryset.extra(
+            where=[f"{self.table}.search_vector @@ to_tsquery('{self.config}', %s)"],
+            params=[tsquery],
+            select={'search_rank': f"ts_rank({self.table}.search_vector, to_tsquery('{self.config}', %s))"},
+            select_params=[tsquery],
+        ).order_by('-search_rank')
+
+
+VENDOR_BACKENDS = {
+    'sqlite': SQLiteFTSBackend,
+    'postgresql': PostgresSearchBackend,
+}
+
+
+def get_search_backend(using: str = DEFAULT_DB_ALIAS) -> ProductSearchBackend:
+    """Backend from settings.SHOP_SEARCH_BACKEND, otherwise picked by database vendor."""
+    connection = connections[using]
+    backend_path = getattr(settings, 'SHOP_SEARCH_BACKEND', None)
+    if backend_path:
+        backend_class = import_string(backend_path)
+    else:
+        backend_class = VENDOR_BACKENDS.get(connection.vendor, ProductSearchBackend)
+    return backend_class(connection)
+
+
+def install_search_backend(sender, using=DEFAULT_DB_ALIAS, **kwargs):
+    connection = connections[using]
+    if Product._meta.db_table in connection.introspection.table_names():
+        get_search_backend(using).install()
+
+
+class ProductSearchFilter(BaseFilterBackend):
+    """DRF filter backend running ?search= through the product search backend."""
+    search_param = 'search'
+
+    def filter_queryset(self, request, queryset, view):
+        query = request.query_params.get(self.search_param, '')
+        if not query.strip():
+            return queryset
+        return get_search_backend(queryset.db).search(queryset, query)
+
+    def get_schema_operation_parameters(self, view):
+        return [{
+            'name': self.search_param,
+            'required': False,
+            'in': 'query',
+            'description': 'Full-text search over name and description, ranked by relevance',
+            'schema': {'type': 'string'},
+        }]
@@ -1,15 +1,199 @@
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
 from rest_framework import serializers
+from rest_framework.relations import ManyRelatedField
 
+from .bulk import orders_written, products_written
 from .models import Product, Order
 
 
-class ProductSerializer(serializers.ModelSerializer):
+def get_requested_fields(request) -> list[str] | None:
+    """Field names from ?fields=a,b of a GET request, None when not given."""
+    if request is None or request.method != 'GET':
+        return None
+    fields = request.query_params.get('fields')
+    if not fields:
+        return None
+    return [name.strip() for name in fields.split(',') if name.strip()]
+
+
+class SparseFieldsetMixin:
+    """Drops the serializer fields not listed in ?fields=."""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        requested = get_requested_fields(self.context.get('request'))
+        if requested:
+            for name in set(self.fields) - set(requested):
+                self.fields.pop(name)
+
+
+class PreloadedPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """Resolves pks from context['related_instances'] when a bulk serializer preloaded them."""
+    def to_internal_value(self, data):
+        model = self.get_queryset().model
+        preloaded = self.context.get('related_instances', {}).get(model)
+        if preloaded is None:
+            return super().to_internal_value(data)
+        if isinstance(data, bool):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        try:
+            pk = model._meta.pk.to_python(data)
+        except DjangoValidationError:
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        if pk not in preloaded:
+            self.fail('does_not_exist', pk_value=data)
+        return preloaded[pk]
+
+
+class BulkListSerializer(serializers.ListSerializer):
+    """
+    many=True serializer writing all items at once. Validation runs in one
+    pass, with the objects referenced by every relation loaded up front by a
+    single IN query per relation. Writes use bulk_create/bulk_update plus one
+    bulk insert of the M2M rows; since no signals are sent, the child's
+    after_bulk_write() takes care of denormalized data and caches.
+
+    update() expects self.instance to be a list matching the data item by item.
+    """
+    batch_size = 1000
+
+    def to_internal_value(self, data):
+        if isinstance(data, list):
+            self.preload_related(data)
+        return super().to_internal_value(data)
+
+    def preload_related(self, data: list) -> None:
+        related = {}
+        for name, field in self.child.fields.items():
+            if field.read_only:
+                continue
+            relation = field.child_relation if isinstance(field, ManyRelatedField) else field
+            if not isinstance(relation, PreloadedPrimaryKeyRelatedField):
+                continue
+            pks = set()
+            for item in data:
+                value = item.get(name) if isinstance(item, dict) else None
+                for pk in value if isinstance(value, list) else [value]:
+                    if isinstance(pk, int) and not isinstance(pk, bool) or isinstance(pk, str) and pk.isdigit():
+                        pks.add(int(pk))
+            queryset = relation.get_queryset()
+            related.setdefault(queryset.model, {}).update(queryset.in_bulk(pks))
+        self.context['related_instances'] = related
+
+    def get_many_to_many_fields(self) -> list[str]:
+        return [
+            name for name, field in self.child.fields.items()
+            if isinstance(field, ManyRelatedField) and not field.read_only
+        ]
+
+    def create(self, validated_data: list[dict]) -> list:
+        model = self.child.Meta.model
+        m2m_fields = self.get_many_to_many_fields()
+        related = [{name: attrs.pop(name) for name in m2m_fields if name in attrs} for attrs in validated_data]
+        instances = [model(**attrs) for attrs in validated_data]
+        with transaction.atomic():
+            if connection.features.can_return_rows_from_bulk_insert:
+                model.objects.bulk_create(instances, batch_size=self.batch_size)
+            else:
+                for instance in instances:
+                    instance.save()
+            self.add_related(instances, related, m2m_fields, replace=False)
+            self.child.after_bulk_write(instances, fields=(), previous=[{} for instance in instances])
+        return instances
+
+    def update(self, instances: list, validated_data: list[dict]) -> list:
+        model = self.child.Meta.model
+        m2m_fields = self.get_many_to_many_fields()
+        related = [{name: attrs.pop(name) for name in m2m_fields if name in attrs} for attrs in validated_data]
+        fields = {name for attrs in validated_data for name in attrs}
+        previous = []
+        for instance, attrs in zip(instances, validated_data):
+            previous.append({
+                model._meta.get_field(name).attname: getattr(instance, model._meta.get_field(name).attname)
+                for name in attrs
+            })
+            for name, value in attrs.items():
+                setattr(instance, name, value)
+        extra_values = self.child.get_bulk_update_values()
+        for field in model._meta.concrete_fields:
+            if getattr(field, 'auto_now', False):
+                extra_values.setdefault(field.name, timezone.now())
+        with transaction.atomic():
+            if fields:
+                for instance in instances:
+                    for name, value in extra_values.items():
+                        setattr(instance, name, value)
+                model.objects.bulk_update(instances, [*fields, *extra_values], batch_size=self.batch_size)
+            self.add_related(instances, related, m2m_fields, replace=True)
+            changed = fields | {name for values in related for name in values}
+            self.child.after_bulk_write(instances, fields=changed, previous=previous)
+        return instances
+
+    def add_related(self, instances: list, related: list[dict], m2m_fields: list[str], replace: bool) -> None:
+        model = self.child.Meta.model
+        for name in m2m_fields:
+            field = model._meta.get_field(name)
+            through = field.remote_field.through
+            source, target = field.m2m_field_name(), field.m2m_reverse_field_name()
+            changed = [(instance, values[name]) for instance, values in zip(instances, related) if name in values]
+            if not changed:
+                continue
+            if replace:
+                through.objects.filter(**{f'{source}__in': [instance for instance, objs in changed]}).delete()
+            through.objects.bulk_create([
+                through(**{f'{source}_id': instance.pk, f'{target}_id': obj.pk})
+                for instance, objs in changed
+                for obj in dict.fromkeys(objs)
+            ], batch_size=self.batch_size)
+
+
+class BulkModelSerializer(serializers.ModelSerializer):
+    serializer_related_field = PreloadedPrimaryKeyRelatedField
+
+    def get_bulk_update_values(self) -> dict:
+        """Extra values bulk_update sets on every updated instance."""
+        return {}
+
+    def after_bulk_write(self, instances: list, fields, previous: list[dict]) -> None:
+        """Stand-in for the signals bulk writes do not send."""
+
+
+class ProductSerializer(SparseFieldsetMixin, BulkModelSerializer):
     class Meta:
         model = Product
-        fields = 'pk', 'name', 'price', 'description', 'discount', 'created_at', 'archived'
+        fields = 'pk', 'name', 'price', 'description', 'discount', 'created_at', 'archived', 'author'
+        # set from the request user on create
+        read_only_fields = ('author',)
+        list_serializer_class = BulkListSerializer
 
+    def get_bulk_update_values(self) -> dict:
+        return {'revision': F('revision') + 1}
 
-class OrderSerializer(serializers.ModelSerializer):
+    def after_bulk_write(self, instances, fields, previous):
+        products_written(instances, updated_fields=fields)
+
+
+class OrderSerializer(SparseFieldsetMixin, BulkModelSerializer):
     class Meta:
         model = Order
-        fields = 'delivery_address', 'promocode', 'created_at', 'user', 'products'
\ No newline at end of file
+        fields = 'pk', 'delivery_address', 'promocode', 'created_at', 'user', 'products', \
+            'product_count', 'total_price', 'total_discounted_price'
+        list_serializer_class = BulkListSerializer
+
+    def after_bulk_write(self, instances, fields, previous):
+        orders_written(instances, previous_user_ids=[values['user_id'] for values in previous if 'user_id' in values])
+
+
+class ProductBulkArchiveSerializer(serializers.Serializer):
+    """Products to archive: explicit ids and/or a filter."""
+    ids = serializers.ListField(child=serializers.IntegerField(min_value=1), required=False, max_length=10_000)
+    search = serializers.CharField(required=False)
+    author = serializers.IntegerField(required=False)
+    archived = serializers.BooleanField(default=True)
+
+    def validate(self, attrs):
+        if not ({'ids', 'search', 'author'} & set(attrs)):
+            raise serializers.ValidationError('Pass ids, search or author.')
+        return attrs
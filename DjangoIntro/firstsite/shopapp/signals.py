@@ -0,0 +1,60 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from .caching import bump_catalog_state, bump_user_orders_version_on_commit
+from .models import Order, Product
+
+
+@receiver(post_save, sender=Order)
+@receiver(post_delete, sender=Order)
+def invalidate_order_owner(sender, instance: Order, using: str, **kwargs):
+    bump_user_orders_version_on_commit(instance.user_id, using=using)
+    loaded_user_id = getattr(instance, '_loaded_user_id', None)
+    if loaded_user_id and loaded_user_id != instance.user_id:
+        bump_user_orders_version_on_commit(loaded_user_id, using=using)
+    instance._loaded_user_id = instance.user_id
+
+
+# changes of Order.products need no handler of their own: refresh_totals()
+# below retires the caches of the owners of every order it recomputes
+@receiver(m2m_changed, sender=Order.products.through)
+def refresh_order_totals(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear' and reverse:
+        instance._cleared_order_ids = list(instance.orders.values_list('pk', flat=True))
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        Order.objects.filter(pk=instance.pk).refresh_totals()
+        instance.refresh_from_db(fields=Order.TOTAL_FIELDS)
+        return
+    order_ids = instance.__dict__.pop('_cleared_order_ids', []) if action == 'post_clear' else pk_set
+    Order.objects.filter(pk__in=order_ids).refresh_totals()
+
+
+@receiver(post_save, sender=Product)
+def refresh_product_orders_totals(sender, instance: Product, created: bool, update_fields=None, **kwargs):
+    # the totals follow the current prices, so only a price or discount change reaches the orders
+    loaded_pricing = getattr(instance, '_loaded_pricing', None)
+    instance._loaded_pricing = instance.pricing
+    if created or (update_fields and not {'price', 'discount'} & set(update_fields)):
+        return
+    if loaded_pricing == instance.pricing:
+        return
+    Order.objects.filter(products=instance).refresh_totals()
+
+
+@receiver(pre_delete, sender=Product)
+def remember_product_orders(sender, instance: Product, **kwargs):
+    instance._order_ids = list(instance.orders.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Product)
+def refresh_deleted_product_orders(sender, instance: Product, **kwargs):
+    Order.objects.filter(pk__in=getattr(instance, '_order_ids', [])).refresh_totals()
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_catalog_pages(sender, instance: Product, **kwargs):
+    bump_catalog_state()
@@ -1,9 +1,31 @@
+import csv
+import json
+import re
+import tempfile
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from pathlib import Path
+from unittest.mock import patch
+
 from django.contrib.auth.models import User
-from django.test import TestCase
+from django.core.cache import cache, caches
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
 
-from .models import Product, Order
+from .bulk import set_archived
+from .caching import get_user_orders_version
+from .importers import import_orders
+from .jobs import claim_next_job, release_stale_jobs, run_job, run_pending_jobs
+from .models import Job, Product, Order
 from .utils import add_two_numbers
+from .views import ProductViewSet
 from django.contrib.auth.models import Permission
 from django.contrib.contenttypes.models import ContentType
 
@@ -77,10 +99,794 @@ class OrdersExportTestCase(TestCase):
             reverse('shopapp:order_export'),
             HTTP_USER_AGENT='TestClient/1.0'
         )
-        data = response.json()
+        data = json.loads(b''.join(response.streaming_content))
 
         self.assertEqual(len(data), 1)
         self.assertEqual(data[0]['delivery_address'], 'Test Address 123')
         self.assertEqual(data[0]['user'], 'staff_user')
         self.assertEqual(data[0]['products'], ['Test Product'])
-        self.assertEqual(response.status_code, 200)
\ No newline at end of file
+        self.assertEqual(response.status_code, 200)
+
+    def test_order_export_ndjson(self):
+        second_order = Order.objects.create(delivery_address='Second Address', user=self.staff_user)
+        response = self.client.get(
+            reverse('shopapp:order_export'),
+            {'format': 'ndjson'},
+            HTTP_USER_AGENT='TestClient/1.0'
+        )
+        lines = b''.join(response.streaming_content).decode().splitlines()
+
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertEqual([json.loads(line)['pk'] for line in lines], [self.order.pk, second_order.pk])
+
+
+class OrderCSVImportTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='csv_user', password='qwerty')
+        cls.products = [
+            Product.objects.create(name=f'CSV Product {i}', price=10, author=cls.user)
+            for i in range(3)
+        ]
+
+    def make_rows(self, count):
+        product_ids = ','.join(str(product.pk) for product in self.products)
+        return [
+            {
+                'delivery_address': f'Street {i}',
+                'promocode': 'CSV',
+                'user_id': str(self.user.pk),
+                'products': product_ids,
+            }
+            for i in range(count)
+        ]
+
+    def test_import_orders_constant_queries_per_batch(self):
+        with CaptureQueriesContext(connection) as small:
+            import_orders(self.make_rows(2), batch_size=50)
+        with CaptureQueriesContext(connection) as large:
+            import_orders(self.make_rows(40), batch_size=50)
+
+        self.assertEqual(len(small), len(large))
+        self.assertEqual(Order.objects.filter(promocode='CSV').count(), 42)
+        self.assertEqual(Order.products.through.objects.count(), 42 * len(self.products))
+
+    def test_import_orders_rejects_unknown_references(self):
+        rows = self.make_rows(1)
+        rows[0]['products'] = '999999'
+
+        with self.assertRaises(ValidationError):
+            import_orders(rows)
+        self.assertFalse(Order.objects.filter(promocode='CSV').exists())
+
+
+class CSVJobsTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser(username='csv_admin', password='qwerty')
+        cls.product = Product.objects.create(name='Exported', price=15, author=cls.admin)
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        media_settings = override_settings(MEDIA_ROOT=media.name)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+        self.client.force_login(self.admin)
+
+    def test_export_runs_as_job_with_fk_ids(self):
+        response = self.client.post(
+            reverse('admin:shopapp_product_changelist'),
+            {'action': 'export_cvs', '_selected_action': [self.product.pk]},
+            HTTP_USER_AGENT='TestClient/1.0'
+        )
+        job = Job.objects.get()
+        self.assertRedirects(response, reverse('admin:shopapp_job_change', args=[job.pk]))
+        self.assertEqual(job.status, Job.Status.PENDING)
+
+        self.assertEqual(run_pending_jobs(), 1)
+        status = self.client.get(reverse('admin:shopapp_job_status', args=[job.pk])).json()
+        self.assertEqual((status['status'], status['percent'], status['total']), ('done', 100, 1))
+
+        response = self.client.get(status['download_url'])
+        header, row = b''.join(response.streaming_content).decode().splitlines()
+        self.assertIn('author', header.split(','))
+        self.assertEqual(row.split(',')[header.split(',').index('author')], str(self.admin.pk))
+
+    def test_select_all_export_replays_filters_in_chunks(self):
+        for i in range(5):
+            Product.objects.create(name=f'Exported {i}', price=1, author=self.admin)
+        Product.objects.create(name='Other', price=1, author=self.admin)
+        response = self.client.post(
+            reverse('admin:shopapp_product_changelist') + '?q=Exported',
+            {'action': 'export_cvs', 'select_across': '1', '_selected_action': [self.product.pk]},
+        )
+        job = Job.objects.get()
+        self.assertRedirects(response, reverse('admin:shopapp_job_change', args=[job.pk]))
+        self.assertNotIn('pks', job.params)
+
+        Job.objects.filter(pk=job.pk).update(params={**job.params, 'chunk_size': 2})
+        job = run_job(claim_next_job())
+        self.assertEqual((job.status, job.processed, job.total), (Job.Status.DONE, 6, 6))
+        with job.result_file.open('r') as file:
+            names = [row['name'] for row in csv.DictReader(file)]
+        self.assertEqual(sorted(names), ['Exported', *[f'Exported {i}' for i in range(5)]])
+
+    def test_stale_running_jobs_are_released(self):
+        long_ago = timezone.now() - timedelta(hours=1)
+        export = Job.objects.create(kind=Job.Kind.EXPORT_CSV, status=Job.Status.RUNNING, heartbeat_at=long_ago)
+        import_job = Job.objects.create(kind=Job.Kind.IMPORT_ORDERS, status=Job.Status.RUNNING, heartbeat_at=long_ago)
+        alive = Job.objects.create(kind=Job.Kind.IMPORT_ORDERS, status=Job.Status.RUNNING, heartbeat_at=timezone.now())
+
+        self.assertEqual(release_stale_jobs(), 2)
+
+        statuses = dict(Job.objects.values_list('pk', 'status'))
+        self.assertEqual(statuses[export.pk], Job.Status.PENDING)
+        self.assertEqual(statuses[import_job.pk], Job.Status.FAILED)
+        self.assertEqual(statuses[alive.pk], Job.Status.RUNNING)
+
+    def upload_orders(self, products: str):
+        csv_file = SimpleUploadedFile(
+            'orders.csv',
+            f'delivery_address,promocode,user_id,products\nJob street,JOB,{self.admin.pk},"{products}"\n'.encode(),
+        )
+        return self.client.post(reverse('admin:import_orders_csv'), {'csv_file': csv_file})
+
+    def test_import_runs_as_job(self):
+        response = self.upload_orders(str(self.product.pk))
+        job = Job.objects.get(kind=Job.Kind.IMPORT_ORDERS)
+        self.assertRedirects(response, reverse('admin:shopapp_job_change', args=[job.pk]))
+        self.assertFalse(Order.objects.filter(promocode='JOB').exists())
+
+        job = run_job(claim_next_job())
+        self.assertEqual(job.status, Job.Status.DONE)
+        self.assertEqual((job.processed, job.total), (1, 1))
+        self.assertEqual(Order.objects.get(promocode='JOB').total_price, Decimal('15.00'))
+
+    def test_failed_import_reports_lines_and_imports_nothing(self):
+        self.upload_orders('999999')
+        job = run_job(claim_next_job())
+
+        self.assertEqual(job.status, Job.Status.FAILED)
+        self.assertIn('Line 2: unknown products [999999]', job.message)
+        self.assertFalse(Order.objects.filter(promocode='JOB').exists())
+        self.assertIsNone(claim_next_job())
+
+
+class UserExportCacheTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='export_user', password='qwerty')
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+        self.url = reverse('shopapp:user_export', kwargs={'user_id': self.user.pk})
+        self.order = Order.objects.create(delivery_address='Cached 1', user=self.user)
+
+    def test_export_is_cached_and_invalidated_on_order_change(self):
+        first = self.client.get(self.url, HTTP_USER_AGENT='TestClient/1.0')
+        with patch('shopapp.views.serializers.serialize') as serialize:
+            second = self.client.get(self.url, HTTP_USER_AGENT='TestClient/1.0')
+        serialize.assert_not_called()
+        self.assertEqual(first.content, second.content)
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            Order.objects.create(delivery_address='Cached 2', user=self.user)
+        # until the commit a concurrent rebuild could only see the old rows, so the version stays
+        self.assertEqual(self.client.get(self.url, HTTP_USER_AGENT='TestClient/1.0').content, first.content)
+        for callback in callbacks:
+            callback()
+        third = self.client.get(self.url, HTTP_USER_AGENT='TestClient/1.0')
+        self.assertContains(third, 'Cached 2')
+
+    def test_export_follows_product_price_changes(self):
+        product = Product.objects.create(name='Priced', price=Decimal('10.00'), author=self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.order.products.add(product)
+        self.assertContains(self.client.get(self.url, HTTP_USER_AGENT='TestClient/1.0'), '10.00')
+
+        product.price = Decimal('99.00')
+        with self.captureOnCommitCallbacks(execute=True):
+            product.save()
+        self.assertContains(self.client.get(self.url, HTTP_USER_AGENT='TestClient/1.0'), '99.00')
+
+        self.user.user_permissions.add(Permission.objects.get(codename='change_product'))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(
+                reverse('shopapp:product-bulk-update'), [{'pk': product.pk, 'price': '42.00'}],
+                content_type='application/json',
+            )
+        self.assertContains(self.client.get(self.url, HTTP_USER_AGENT='TestClient/1.0'), '42.00')
+
+
+@override_settings(CACHES={
+    'default': {
+        'BACKEND': 'firstsite.cache_backends.TieredCache',
+        'LOCATION': 'shared',
+        'OPTIONS': {'LOCAL_TIMEOUT': 5},
+    },
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'tiered-test-shared',
+    },
+})
+class TieredCacheTestCase(TestCase):
+    def test_reads_are_served_from_local_tier(self):
+        cache.set('tiered_key', 'value')
+        caches['shared'].delete('tiered_key')
+
+        self.assertEqual(cache.get('tiered_key'), 'value')
+        cache.delete('tiered_key')
+        self.assertIsNone(cache.get('tiered_key'))
+
+    def test_incr_refreshes_local_copy(self):
+        cache.add('tiered_counter', 1)
+        cache.incr('tiered_counter')
+
+        self.assertEqual(cache.get('tiered_counter'), 2)
+        self.assertEqual(caches['shared'].get('tiered_counter'), 2)
+
+
+class AsyncProductViewsTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='async_user', password='qwerty')
+        cls.product = Product.objects.create(name='Async Product', price=20, author=cls.user)
+
+    async def test_products_list(self):
+        response = await self.async_client.get(reverse('shopapp:products_list'))
+        self.assertContains(response, 'Async Product')
+
+    async def test_product_details(self):
+        response = await self.async_client.get(reverse('shopapp:product_details', kwargs={'pk': self.product.pk}))
+        self.assertContains(response, 'async_user')
+
+        response = await self.async_client.get(reverse('shopapp:product_details', kwargs={'pk': 0}))
+        self.assertEqual(response.status_code, 404)
+
+    async def test_latest_products_feed(self):
+        response = await self.async_client.get(reverse('shopapp:latest_feed'))
+        self.assertContains(response, 'Async Product')
+
+    def test_products_list_under_wsgi(self):
+        response = self.client.get(reverse('shopapp:products_list'))
+        self.assertContains(response, 'Async Product')
+
+
+class ConditionalProductPagesTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='conditional_user', password='qwerty')
+        cls.product = Product.objects.create(name='Conditional Product', price=30, author=cls.user)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_products_list_not_modified(self):
+        url = reverse('shopapp:products_list')
+        response = self.client.get(url)
+        self.assertIn('Last-Modified', response)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(len(queries), 0)
+
+    def test_anonymous_products_list_is_cached_until_product_save(self):
+        url = reverse('shopapp:products_list')
+        etag = self.client.get(url)['ETag']
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertContains(response, 'Conditional Product')
+        self.assertEqual(len(queries), 0)
+
+        self.product.name = 'Renamed Product'
+        self.product.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertContains(response, 'Renamed Product')
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_product_details_etag_per_viewer(self):
+        url = reverse('shopapp:product_details', kwargs={'pk': self.product.pk})
+        etag = self.client.get(url)['ETag']
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        self.client.force_login(self.user)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Edit product')
+
+    def test_archive_action_changes_product_etag(self):
+        url = reverse('shopapp:product_details', kwargs={'pk': self.product.pk})
+        etag = self.client.get(url)['ETag']
+        set_archived(Product.objects.filter(pk=self.product.pk), True)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_concurrent_saves_get_their_own_revisions(self):
+        first, second = Product.objects.get(pk=self.product.pk), Product.objects.get(pk=self.product.pk)
+        first.name = 'First edit'
+        first.save()
+        second.description = 'Second edit'
+        second.save()
+
+        self.assertEqual((first.revision, second.revision), (self.product.revision + 1, self.product.revision + 2))
+        self.assertEqual(Product.objects.get(pk=self.product.pk).revision, second.revision)
+
+
+class ProductsListPaginationTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='catalog_user', password='qwerty')
+        Product.objects.bulk_create([
+            Product(name=f'Catalog {i:02}', price=10, author=cls.user) for i in range(25)
+        ])
+        Product.objects.create(name='Catalog 00', price=5, author=cls.user, archived=True)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def get_names(self, response) -> list[str]:
+        return re.findall(r'Catalog \d+', response.content.decode())
+
+    def test_keyset_pages(self):
+        url = reverse('shopapp:products_list')
+        first = self.client.get(url)
+        self.assertEqual(self.get_names(first), [f'Catalog {i:02}' for i in range(20)])
+        self.assertIsNone(first.context['page'].previous_cursor)
+
+        second = self.client.get(url, {'cursor': first.context['page'].next_cursor})
+        self.assertEqual(self.get_names(second), [f'Catalog {i:02}' for i in range(20, 25)])
+        self.assertIsNone(second.context['page'].next_cursor)
+
+        back = self.client.get(url, {'cursor': second.context['page'].previous_cursor})
+        self.assertEqual(self.get_names(back), self.get_names(first))
+
+        self.assertEqual(self.client.get(url, {'cursor': 'garbage'}).status_code, 404)
+
+    def test_cached_page_fragment(self):
+        url = reverse('shopapp:products_list')
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(url)
+        self.assertFalse([q for q in queries if 'auth_user' in q['sql'] and '"id" IN' in q['sql']])
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(len(self.get_names(response)), 20)
+        product_queries = [q for q in queries if 'shopapp_product' in q['sql']]
+        self.assertEqual(len(product_queries), 1)
+
+        product = Product.objects.get(name='Catalog 03')
+        product.name = 'Catalog 035'
+        product.save()
+        self.assertIn('Catalog 035', self.get_names(self.client.get(url)))
+
+
+class ProductAPIPaginationTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='api_user', password='qwerty')
+        Product.objects.bulk_create([
+            Product(name=f'API Product {i:02}', price=i, author=cls.user)
+            for i in range(25)
+        ])
+
+    def test_cursor_pagination_walks_all_products(self):
+        url = reverse('shopapp:product-list') + '?pagination=cursor'
+        seen = []
+        while url:
+            data = self.client.get(url).json()
+            self.assertNotIn('count', data)
+            seen.extend(product['pk'] for product in data['results'])
+            url = data['next']
+
+        self.assertEqual(len(seen), 25)
+        self.assertEqual(len(set(seen)), 25)
+
+    def test_page_without_count(self):
+        with CaptureQueriesContext(connection) as queries:
+            data = self.client.get(reverse('shopapp:product-list'), {'count': 'false', 'page': 3}).json()
+
+        self.assertNotIn('count', data)
+        self.assertEqual(len(data['results']), 5)
+        self.assertIsNone(data['next'])
+        self.assertFalse(any('COUNT(' in query['sql'] for query in queries))
+
+    def test_sparse_fieldset(self):
+        with CaptureQueriesContext(connection) as queries:
+            data = self.client.get(reverse('shopapp:product-list'), {'fields': 'pk,name'}).json()
+
+        self.assertEqual(set(data['results'][0]), {'pk', 'name'})
+        select = [query['sql'] for query in queries if 'shopapp_product' in query['sql']][-1]
+        self.assertNotIn('"description"', select)
+
+
+class ProductBulkArchiveTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.editor = User.objects.create_user(username='bulk_editor', password='qwerty')
+        cls.editor.user_permissions.add(Permission.objects.get(codename='change_product'))
+        cls.author = User.objects.create_user(username='bulk_author', password='qwerty')
+        cls.products = Product.objects.bulk_create([
+            Product(name=f'Bulk SKU {i}', author=cls.author if i < 5 else cls.editor) for i in range(12)
+        ])
+        Product.objects.create(name='Bulk keyboard', description='mechanical', author=cls.editor)
+
+    def setUp(self):
+        self.client.force_login(self.editor)
+        self.url = reverse('shopapp:product-bulk-archive')
+
+    def test_archive_ids_in_batches(self):
+        ids = [product.pk for product in self.products[:7]]
+        with patch('shopapp.bulk.bump_catalog_state') as bump, \
+                patch.object(ProductViewSet, 'bulk_archive_batch_size', 3):
+            response = self.client.post(self.url, {'ids': ids}, content_type='application/json')
+        self.assertEqual(response.json(), {'archived': True, 'matched': 7, 'updated': 7})
+        self.assertEqual(bump.call_count, 3)
+        self.assertEqual(Product.objects.filter(pk__in=ids, archived=True).count(), 7)
+
+        response = self.client.post(self.url, {'ids': ids[:2], 'archived': False}, content_type='application/json')
+        self.assertEqual(response.json()['updated'], 2)
+        self.assertEqual(Product.objects.filter(archived=True).count(), 5)
+
+    def test_archive_by_filter(self):
+        response = self.client.post(self.url, {'author': self.author.pk}, content_type='application/json')
+        self.assertEqual(response.json()['updated'], 5)
+
+        response = self.client.post(self.url, {'search': 'keyboard'}, content_type='application/json')
+        self.assertEqual(response.json()['updated'], 1)
+        self.assertTrue(Product.objects.get(name='Bulk keyboard').archived)
+
+    def test_requires_change_permission_and_selection(self):
+        response = self.client.post(self.url, {}, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+        self.client.force_login(self.author)
+        response = self.client.post(self.url, {'ids': [self.products[0].pk]}, content_type='application/json')
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(Product.objects.filter(archived=True).exists())
+
+
+class BulkWriteAPITestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='bulk_api_user', password='qwerty')
+        cls.user.user_permissions.add(*Permission.objects.filter(
+            codename__in=['add_product', 'change_product', 'add_order', 'change_order'],
+        ))
+        cls.buyer = User.objects.create_user(username='bulk_api_buyer', password='qwerty')
+        cls.products = [
+            Product.objects.create(name=f'Bulk API {i}', price=Decimal('10.00'), author=cls.user) for i in range(3)
+        ]
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def post_products(self, count: int):
+        items = [{'name': f'ERP {i}', 'price': '5.00', 'author': self.buyer.pk} for i in range(count)]
+        return self.client.post(reverse('shopapp:product-list'), items, content_type='application/json')
+
+    def test_bulk_create_products_in_constant_queries(self):
+        with CaptureQueriesContext(connection) as small:
+            self.post_products(3)
+        with CaptureQueriesContext(connection) as large:
+            response = self.post_products(30)
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(response.json()), 30)
+        self.assertEqual(len(small), len(large))
+        # author is read-only, the products belong to the caller
+        self.assertEqual(Product.objects.filter(name__startswith='ERP', author=self.user).count(), 33)
+
+    def test_bulk_writes_need_model_permissions(self):
+        product = self.products[0]
+        update = [{'pk': product.pk, 'archived': True}]
+        self.client.logout()
+        self.assertIn(self.post_products(1).status_code, (401, 403))
+        response = self.client.patch(reverse('shopapp:product-bulk-update'), update, content_type='application/json')
+        self.assertIn(response.status_code, (401, 403))
+
+        self.client.force_login(self.buyer)
+        self.assertEqual(self.post_products(1).status_code, 403)
+        response = self.client.patch(reverse('shopapp:product-bulk-update'), update, content_type='application/json')
+        self.assertEqual(response.status_code, 403)
+        response = self.client.post(
+            reverse('shopapp:order-list'), [{'delivery_address': 'Nope', 'user': self.buyer.pk}],
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 403)
+
+        self.assertFalse(Product.objects.filter(name__startswith='ERP').exists())
+        self.assertFalse(Product.objects.get(pk=product.pk).archived)
+
+    def test_single_writes_need_model_permissions(self):
+        product = self.products[0]
+        self.client.logout()
+        self.assertEqual(self.client.get(reverse('shopapp:product-list')).status_code, 200)
+        response = self.client.post(
+            reverse('shopapp:product-list'), {'name': 'ERP single', 'price': '1.00'}, content_type='application/json',
+        )
+        self.assertIn(response.status_code, (401, 403))
+        response = self.client.delete(reverse('shopapp:product-detail', kwargs={'pk': product.pk}))
+        self.assertIn(response.status_code, (401, 403))
+
+        self.client.force_login(self.buyer)
+        response = self.client.patch(
+            reverse('shopapp:product-detail', kwargs={'pk': product.pk}), {'archived': True},
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 403)
+        response = self.client.post(reverse('shopapp:product-bulk-archive'), {'ids': [product.pk]},
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 403)
+
+        self.assertTrue(Product.objects.filter(pk=product.pk, archived=False).exists())
+
+    def test_bulk_create_rejects_unknown_references(self):
+        items = [
+            {'delivery_address': 'ERP ok', 'user': self.buyer.pk, 'products': [self.products[0].pk]},
+            {'delivery_address': 'ERP bad', 'user': self.buyer.pk, 'products': [0]},
+        ]
+        response = self.client.post(reverse('shopapp:order-list'), items, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()[0], {})
+        self.assertIn('products', response.json()[1])
+        self.assertFalse(Order.objects.filter(delivery_address__startswith='ERP').exists())
+
+    def test_bulk_create_orders_with_products(self):
+        version = get_user_orders_version(self.buyer.pk)
+        items = [
+            {'delivery_address': f'Bulk street {i}', 'user': self.buyer.pk, 'products': [p.pk for p in self.products]}
+            for i in range(5)
+        ]
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('shopapp:order-list'), items, content_type='application/json')
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()[0]['products'], [p.pk for p in self.products])
+        self.assertEqual(response.json()[0]['total_price'], '30.00')
+        self.assertEqual(Order.products.through.objects.filter(order__user=self.buyer).count(), 15)
+        self.assertGreater(get_user_orders_version(self.buyer.pk), version)
+
+    def test_bulk_update_products_refreshes_order_totals(self):
+        order = Order.objects.create(delivery_address='Bulk update street', user=self.buyer)
+        order.products.set(self.products)
+        items = [{'pk': product.pk, 'price': '20.00'} for product in self.products[:2]]
+        response = self.client.patch(
+            reverse('shopapp:product-bulk-update'), items, content_type='application/json',
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual({item['price'] for item in response.json()}, {'20.00'})
+        order.refresh_from_db()
+        self.assertEqual(order.total_price, Decimal('50.00'))
+        self.assertEqual(Product.objects.get(pk=self.products[0].pk).revision, self.products[0].revision + 1)
+
+    def test_bulk_update_orders_moves_them_between_users(self):
+        orders = [Order.objects.create(delivery_address=f'Move {i}', user=self.user) for i in range(2)]
+        versions = get_user_orders_version(self.user.pk), get_user_orders_version(self.buyer.pk)
+        items = [{'pk': order.pk, 'user': self.buyer.pk, 'products': [self.products[0].pk]} for order in orders]
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(reverse('shopapp:order-bulk-update'), items, content_type='application/json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Order.objects.filter(user=self.buyer, product_count=1).count(), 2)
+        self.assertGreater(get_user_orders_version(self.user.pk), versions[0])
+        self.assertGreater(get_user_orders_version(self.buyer.pk), versions[1])
+
+        response = self.client.patch(
+            reverse('shopapp:order-bulk-update'), [{'pk': 0, 'promocode': 'X'}], content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 400)
+
+
+class OrderAPIQueriesTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='orders_api_user', password='qwerty')
+        products = [Product.objects.create(name=f'Order API {i}', author=cls.user) for i in range(3)]
+        for i in range(20):
+            order = Order.objects.create(delivery_address=f'Order API street {i}', user=cls.user)
+            order.products.set(products)
+
+    def test_list_runs_constant_number_of_queries(self):
+        url = reverse('shopapp:order-list')
+        with CaptureQueriesContext(connection) as small_page:
+            self.client.get(url, {'page_size': 2})
+        with CaptureQueriesContext(connection) as large_page:
+            data = self.client.get(url, {'page_size': 20}).json()
+
+        self.assertEqual(len(small_page), len(large_page))
+        self.assertEqual(len(data['results']), 20)
+        self.assertEqual(len(data['results'][0]['products']), 3)
+
+    def test_filter_by_products_has_no_duplicates(self):
+        product_ids = list(Product.objects.filter(name__startswith='Order API').values_list('pk', flat=True))
+        data = self.client.get(
+            reverse('shopapp:order-list'),
+            {'products': product_ids, 'page_size': 100},
+        ).json()
+
+        self.assertEqual(data['count'], 20)
+        self.assertEqual(len({order['delivery_address'] for order in data['results']}), 20)
+
+
+class OrderListViewsQueriesTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='order_list_user', password='qwerty')
+        cls.other = User.objects.create_user(username='order_list_other', password='qwerty')
+        products = [Product.objects.create(name=f'Order list {i}', author=cls.user) for i in range(3)]
+        for i in range(25):
+            order = Order.objects.create(delivery_address=f'Order list street {i}', user=cls.user)
+            order.products.set(products)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def test_orders_list_is_paginated_with_constant_queries(self):
+        # session, user, count, orders with their users, prefetched products
+        with self.assertNumQueries(5):
+            response = self.client.get(reverse('shopapp:orders_list'))
+        self.assertEqual(len(response.context['object_list']), 20)
+        self.assertContains(response, 'Order list 2 for $')
+
+        with self.assertNumQueries(5):
+            response = self.client.get(reverse('shopapp:orders_list'), {'page': 2})
+        self.assertEqual(len(response.context['object_list']), 5)
+
+    def test_user_orders_fragment_is_cached_per_owner(self):
+        url = reverse('shopapp:user_order_list', kwargs={'user_id': self.user.pk})
+        other_url = reverse('shopapp:user_order_list', kwargs={'user_id': self.other.pk})
+        self.client.get(url)
+        # session, user, owner, count: the orders come from the fragment cache
+        with self.assertNumQueries(4):
+            response = self.client.get(url)
+        self.assertContains(response, 'Order #', count=20)
+
+        response = self.client.get(other_url)
+        self.assertNotContains(response, 'Order #')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            order = Order.objects.create(delivery_address='Order list new', user=self.other)
+        response = self.client.get(other_url)
+        self.assertContains(response, f'Order #{order.pk}')
+
+
+class OrderTotalsTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='totals_user', password='qwerty')
+        cls.laptop = Product.objects.create(name='Totals laptop', price=Decimal('100.00'), discount=10, author=cls.user)
+        cls.mouse = Product.objects.create(name='Totals mouse', price=Decimal('15.00'), discount=33, author=cls.user)
+
+    def setUp(self):
+        self.order = Order.objects.create(delivery_address='Totals street', user=self.user)
+
+    def test_totals_follow_products(self):
+        self.order.products.add(self.laptop, self.mouse)
+        self.assertEqual(self.order.product_count, 2)
+        self.assertEqual(self.order.total_price, Decimal('115.00'))
+        self.assertEqual(self.order.total_discounted_price, Decimal('100.05'))
+
+        self.mouse.orders.remove(self.order)
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.product_count, 1)
+        self.assertEqual(self.order.total_price, Decimal('100.00'))
+
+        self.laptop.price = Decimal('200.00')
+        self.laptop.save()
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.total_discounted_price, Decimal('180.00'))
+
+    def test_saves_without_price_change_leave_orders_alone(self):
+        self.order.products.add(self.laptop)
+        product = Product.objects.get(pk=self.laptop.pk)
+        product.name = 'Renamed laptop'
+        product.price = Decimal('100')
+        with CaptureQueriesContext(connection) as queries:
+            product.save()
+        self.assertFalse([query for query in queries if 'shopapp_order' in query['sql']])
+
+        product.discount = 50
+        product.save()
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.total_discounted_price, Decimal('50.00'))
+
+    def test_rebuild_command(self):
+        self.order.products.add(self.laptop)
+        Order.objects.update(product_count=0, total_price=0, total_discounted_price=0)
+
+        call_command('rebuild_order_totals', stdout=StringIO())
+        self.order.refresh_from_db()
+
+        self.assertEqual(self.order.product_count, 1)
+        self.assertEqual(self.order.total_discounted_price, Decimal('90.00'))
+
+
+class CacheBenchCommandTestCase(TestCase):
+    def test_keeps_the_site_cache(self):
+        user = User.objects.create_user(username='cachebench_user', password='qwerty')
+        Order.objects.create(delivery_address='Bench Address', user=user)
+        cache.set('site-key', 'kept')
+        stdout = StringIO()
+
+        call_command('cachebench', user=user.pk, requests=2, tiers=['locmem', 'file', 'tiered'], stdout=stdout)
+
+        self.assertIn('Cache benchmark finished', stdout.getvalue())
+        self.assertNotIn('skipped', stdout.getvalue())
+        self.assertEqual(cache.get('site-key'), 'kept')
+
+
+class ShopBenchCommandTestCase(TestCase):
+    def test_writes_results_and_removes_seeded_data(self):
+        with tempfile.TemporaryDirectory() as directory:
+            output = Path(directory) / 'result.json'
+            call_command(
+                'shopbench', users=2, products=5, orders=5, requests=2,
+                output=str(output), stdout=StringIO(),
+            )
+            result = json.loads(output.read_text())
+
+        self.assertEqual(result['dataset']['orders'], 5)
+        for name, endpoint in result['endpoints'].items():
+            self.assertEqual(endpoint['status'], 200, name)
+            self.assertGreaterEqual(endpoint['p99_ms'], endpoint['p50_ms'])
+        self.assertFalse(Order.objects.filter(promocode='BENCH').exists())
+        self.assertFalse(User.objects.filter(username__startswith='bench').exists())
+
+
+class HotQuerysetIndexesTestCase(TestCase):
+    full_scan = re.compile(r'Seq Scan|\bSCAN (shopapp_\w+)\b(?! USING)')
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='explain_user', password='qwerty')
+
+    def assertUsesIndex(self, queryset):
+        plan = queryset.explain()
+        self.assertIsNone(self.full_scan.search(plan), plan)
+
+    def test_products_list(self):
+        self.assertUsesIndex(Product.objects.filter(archived=False))
+
+    def test_latest_products(self):
+        self.assertUsesIndex(Product.objects.filter(created_at__isnull=False).order_by('-created_at')[:5])
+
+    def test_user_orders(self):
+        self.assertUsesIndex(Order.objects.filter(user=self.user, created_at__gte='2025-01-01'))
+        self.assertUsesIndex(Order.objects.filter(user=self.user, promocode='SALE'))
+
+
+class ProductSearchTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='search_user', password='qwerty')
+        cls.keyboard = Product.objects.create(name='Mechanical keyboard', description='Blue switches', author=cls.user)
+        cls.mouse = Product.objects.create(name='Mouse', description='Works with any keyboard', author=cls.user)
+        Product.objects.create(name='Monitor', description='27 inch', author=cls.user)
+
+    def search(self, query):
+        data = self.client.get(reverse('shopapp:product-list'), {'search': query, 'page_size': 100}).json()
+        return [product['pk'] for product in data['results']]
+
+    def test_name_matches_rank_first(self):
+        self.assertEqual(self.search('keyboard'), [self.keyboard.pk, self.mouse.pk])
+
+    def test_prefix_and_index_updates(self):
+        self.assertEqual(self.search('mech'), [self.keyboard.pk])
+
+        self.keyboard.name = 'Membrane keyboard'
+        self.keyboard.save()
+        self.assertEqual(self.search('mech'), [])
+
+        self.mouse.delete()
+        self.assertEqual(self.search('keyboard'), [self.keyboard.pk])
+
+    def test_operators_in_query_are_ignored(self):
+        self.assertEqual(self.search('"monitor" OR ('), [])
+        self.assertEqual(len(self.search('inch*')), 1)
@@ -0,0 +1,79 @@
+from datetime import datetime
+from hashlib import md5
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpRequest, HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from django.utils.translation import get_language
+
+from myauth.permissions import get_permissions_version
+
+
+def _digest(value: str) -> str:
+    return md5(value.encode(), usedforsecurity=False).hexdigest()
+
+
+class ConditionalPageMixin:
+    """
+    Conditional GET and a page cache for async read-only views.
+
+    get_page_state() returns a version string that changes whenever the page
+    would render differently and the time of the last change. Matching
+    If-None-Match / If-Modified-Since requests get a 304 before anything is
+    rendered. Pages of anonymous users are also cached per language and path
+    under that version, so a product write retires them without deleting keys.
+    """
+    page_cache_timeout = settings.CACHE_MIDDLEWARE_SECONDS
+
+    async def get_page_state(self) -> tuple[str, datetime] | None:
+        """Version and modification time of the page, None if it does not exist."""
+        raise NotImplementedError
+
+    def get_page_cache_key(self, version: str) -> str:
+        return f'page_{get_language()}_{_digest(self.request.get_full_path())}_{version}'
+
+    async def dispatch(self, request: HttpRequest, *args, **kwargs) -> HttpResponse:
+        if request.method not in ('GET', 'HEAD'):
+            return await super().dispatch(request, *args, **kwargs)
+        state = await self.get_page_state()
+        if state is None:
+            return await super().dispatch(request, *args, **kwargs)
+
+        version, modified_at = state
+        user = await request.auser()
+        # pages show edit links depending on the viewer and their permissions
+        viewer = 'anonymous'
+        if user.is_authenticated:
+            viewer = f'user{user.pk}_{await sync_to_async(get_permissions_version)(user.pk)}'
+        etag = quote_etag(_digest(f'{get_language()}:{viewer}:{version}'))
+        last_modified = int(modified_at.timestamp())
+
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is not None:
+            return self.set_validators(response, etag, last_modified)
+
+        cache_key = None
+        if not user.is_authenticated:
+            cache_key = self.get_page_cache_key(version)
+            response = await cache.aget(cache_key)
+            if response is not None:
+                return response
+
+        response = await super().dispatch(request, *args, **kwargs)
+        if response.status_code != 200:
+            return response
+        self.set_validators(response, etag, last_modified)
+        if cache_key is not None:
+            response.add_post_render_callback(
+                lambda rendered: cache.set(cache_key, rendered, self.page_cache_timeout)
+            )
+        return response
+
+    @staticmethod
+    def set_validators(response: HttpResponse, etag: str, last_modified: int) -> HttpResponse:
+        response.headers['ETag'] = etag
+        response.headers['Last-Modified'] = http_date(last_modified)
+        return response
@@ -1,24 +1,41 @@
+import json
 import logging
 from timeit import default_timer
+
+from asgiref.sync import markcoroutinefunction
 from django.contrib.auth.mixins import LoginRequiredMixin, PermissionRequiredMixin, UserPassesTestMixin
 from django.contrib.auth.models import Group, User
 from django.contrib.syndication.views import Feed
 from django.core import serializers
-from django.core.cache import cache
 from django.core.exceptions import PermissionDenied
-from django.http import HttpRequest, HttpResponse, HttpResponseRedirect, JsonResponse
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Prefetch
+from django.http import Http404, HttpRequest, HttpResponse, HttpResponseRedirect, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render, redirect, reverse, get_object_or_404
 from django.urls import reverse_lazy
+from django.utils.translation import gettext as _
 from django.views import View
 from django.views.generic import TemplateView, ListView, DetailView, CreateView, UpdateView, DeleteView
 from django_filters.rest_framework import DjangoFilterBackend
-from rest_framework.filters import SearchFilter, OrderingFilter
+from rest_framework.decorators import action
+from rest_framework.filters import OrderingFilter
+from rest_framework.permissions import DjangoModelPermissionsOrAnonReadOnly
+from rest_framework.request import Request
+from rest_framework.response import Response
 from rest_framework.viewsets import ModelViewSet
 
+from requestdaapp.query_budget import QueryBudgetMixin
+
+from .api_mixins import BulkWriteMixin, ChangeModelPermissions, SerializerQuerysetMixin, SparseFieldsetViewMixin
+from .bulk import set_archived
+from .caching import aget_catalog_state, get_or_build, get_user_orders_version, user_orders_export_key
 from .forms import ProductForm, OrderForm, GroupForm
 from .models import Product
 from .models import Order
-from .serializers import OrderSerializer, ProductSerializer
+from .pagination import KeysetPaginator, ShopPagination
+from .search import ProductSearchFilter, get_search_backend
+from .serializers import OrderSerializer, ProductBulkArchiveSerializer, ProductSerializer
+from .view_mixins import ConditionalPageMixin
 
 log = logging.getLogger(__name__)
 
@@ -50,16 +67,49 @@ class GroupsListView(View):
             form.save()
         return redirect(request.path)
 
-class ProductDetailsView(DetailView):
+class ProductDetailsView(ConditionalPageMixin, DetailView):
     template_name = 'shopapp/products-details.html'
     model = Product
     context_object_name = 'product'
+    queryset = Product.objects.select_related('author')
 
-class ProductsListView(ListView):
+    async def get_page_state(self):
+        state = await (
+            Product.objects.filter(pk=self.kwargs['pk']).values_list('revision', 'updated_at').afirst()
+        )
+        if state is None:
+            return None
+        revision, updated_at = state
+        return f'{self.kwargs["pk"]}.{revision}', updated_at
+
+    async def get(self, request: HttpRequest, *args, **kwargs) -> HttpResponse:
+        try:
+            self.object = await self.get_queryset().aget(pk=self.kwargs['pk'])
+        except Product.DoesNotExist:
+            raise Http404(_('No product found matching the query'))
+        context = self.get_context_data(object=self.object)
+        return self.render_to_response(context)
+
+class ProductsListView(ConditionalPageMixin, ListView):
     template_name = 'shopapp/products-list.html'
     model = Product
     context_object_name = 'products'
     queryset = Product.objects.filter(archived=False)
+    page_size = 20
+    page_ordering = ('name', 'price', 'pk')
+
+    async def get_page_state(self):
+        return await aget_catalog_state()
+
+    async def get(self, request: HttpRequest, *args, **kwargs) -> HttpResponse:
+        paginator = KeysetPaginator(
+            self.get_queryset(), self.page_ordering, self.page_size, version_field='updated_at',
+        )
+        page = await paginator.apage(request.GET.get('cursor'))
+        # evaluated by the template only when the page fragment is not cached
+        self.object_list = page.object_list
+        context = self.get_context_data(page=page)
+        return self.render_to_response(context)
 
 
 class ProductCreateView(LoginRequiredMixin, CreateView):
@@ -99,13 +149,22 @@ class ProductDeleteView(DeleteView):
         self.object.save()
         return HttpResponseRedirect(success_url)
 
-class OrdersListView(LoginRequiredMixin, ListView):
+class OrdersListView(QueryBudgetMixin, LoginRequiredMixin, ListView):
+    # session, user, count, orders with users, products
+    query_budget = 5
+    paginate_by = 20
+    ordering = ('-created_at', '-pk')
     queryset = (
         Order.objects
         .select_related("user")
-        .prefetch_related("products"))
+        .only(
+            'pk', 'promocode', 'delivery_address', *Order.TOTAL_FIELDS,
+            'user__username', 'user__first_name',
+        )
+        .prefetch_related(Prefetch('products', queryset=Product.objects.only('name', 'price'))))
 
-class OrderDetailView(LoginRequiredMixin, DetailView):
+class OrderDetailView(QueryBudgetMixin, LoginRequiredMixin, DetailView):
+    query_budget = 4
     permission_required = 'view_order'
     queryset = (
         Order.objects
@@ -130,33 +189,78 @@ class OrderDeleteView(PermissionRequiredMixin, DeleteView):
     model = Order
     success_url = reverse_lazy('shopapp:orders_list')
 
-class OrdersExportView(UserPassesTestMixin, View):
+class OrdersExportView(QueryBudgetMixin, UserPassesTestMixin, View):
+    chunk_size = 500
+    # session, user and the final empty chunk, plus two queries per streamed chunk
+    query_budget = 3
+    streamed_chunks = 0
+
+    def get_query_budget(self):
+        return self.query_budget + 2 * self.streamed_chunks
+
     def test_func(self):
         return self.request.user.is_staff
 
     def handle_no_permission(self):
         return JsonResponse({'error': 'Forbidden: Staff access required'}, status=403)
 
-    def get(self, request: HttpResponse) -> JsonResponse:
-        orders = Order.objects.select_related('user').prefetch_related('products').all()
-        context_object_name = 'orders_data'
-        orders_data = []
-        for order in orders:
-            orders_data.append({
-                'pk': order.pk,
-                'delivery_address': order.delivery_address,
-                'promocode': order.promocode,
-                'user': order.user.username if order.user else None,
-                'products': [product.name for product in order.products.all()]
-            })
-
-        return JsonResponse(orders_data, safe=False)
-
-class ProductViewSet(ModelViewSet):
+    def get_queryset(self):
+        return (
+            Order.objects
+            .select_related('user')
+            .only('pk', 'delivery_address', 'promocode', 'user__username', *Order.TOTAL_FIELDS)
+            .prefetch_related(Prefetch('products', queryset=Product.objects.only('pk', 'name')))
+            .order_by('pk')
+        )
+
+    def iter_chunks(self):
+        """Keyset pagination over pk, products are prefetched per chunk only."""
+        queryset = self.get_queryset()
+        last_pk = 0
+        while True:
+            chunk = list(queryset.filter(pk__gt=last_pk)[:self.chunk_size])
+            if not chunk:
+                return
+            self.streamed_chunks += 1
+            yield [self.order_to_dict(order) for order in chunk]
+            last_pk = chunk[-1].pk
+
+    @staticmethod
+    def order_to_dict(order: Order) -> dict:
+        return {
+            'pk': order.pk,
+            'delivery_address': order.delivery_address,
+            'promocode': order.promocode,
+            'user': order.user.username if order.user else None,
+            'products': [product.name for product in order.products.all()],
+            'product_count': order.product_count,
+            'total_price': order.total_price,
+            'total_discounted_price': order.total_discounted_price,
+        }
+
+    def stream_json(self):
+        yield '['
+        separator = ''
+        for rows in self.iter_chunks():
+            yield separator + ','.join(json.dumps(row, cls=DjangoJSONEncoder) for row in rows)
+            separator = ','
+        yield ']'
+
+    def stream_ndjson(self):
+        for rows in self.iter_chunks():
+            yield ''.join(json.dumps(row, cls=DjangoJSONEncoder) + '\n' for row in rows)
+
+    def get(self, request: HttpRequest) -> StreamingHttpResponse:
+        if request.GET.get('format') == 'ndjson':
+            return StreamingHttpResponse(self.stream_ndjson(), content_type='application/x-ndjson')
+        return StreamingHttpResponse(self.stream_json(), content_type='application/json')
+
+class ProductViewSet(QueryBudgetMixin, BulkWriteMixin, SerializerQuerysetMixin, SparseFieldsetViewMixin, ModelViewSet):
+    query_budget = {'list': 4, 'retrieve': 3}
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
-    filter_backends = [SearchFilter, OrderingFilter]
-    search_fields = ['name', 'description']
+    pagination_class = ShopPagination
+    filter_backends = [ProductSearchFilter, OrderingFilter]
     ordering_fields = [
         'name',
         'description',
@@ -164,10 +268,39 @@ class ProductViewSet(ModelViewSet):
         'discount',
         'archived',
     ]
-
-class OrderViewSet(ModelViewSet):
-    queryset = Order.objects.all()
+    permission_classes = [DjangoModelPermissionsOrAnonReadOnly]
+    bulk_archive_batch_size = 1000
+
+    def perform_create(self, serializer):
+        serializer.save(author=self.request.user)
+
+    @action(
+        detail=False, methods=['post'], url_path='bulk-archive',
+        serializer_class=ProductBulkArchiveSerializer, permission_classes=[ChangeModelPermissions],
+    )
+    def bulk_archive(self, request: Request) -> Response:
+        """Archive (or with archived=false unarchive) the products matching ids, search and author."""
+        serializer = ProductBulkArchiveSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+
+        queryset = Product.objects.all()
+        if 'ids' in data:
+            queryset = queryset.filter(pk__in=data['ids'])
+        if 'author' in data:
+            queryset = queryset.filter(author_id=data['author'])
+        if 'search' in data:
+            queryset = get_search_backend(queryset.db).search(queryset, data['search'])
+        matched = queryset.count()
+        updated = set_archived(queryset, data['archived'], batch_size=self.bulk_archive_batch_size)
+        return Response({'archived': data['archived'], 'matched': matched, 'updated': updated})
+
+class OrderViewSet(QueryBudgetMixin, BulkWriteMixin, SerializerQuerysetMixin, SparseFieldsetViewMixin, ModelViewSet):
+    query_budget = {'list': 5, 'retrieve': 4}
+    queryset = Order.objects.order_by('pk')
     serializer_class = OrderSerializer
+    permission_classes = [DjangoModelPermissionsOrAnonReadOnly]
+    pagination_class = ShopPagination
     filter_backends = [DjangoFilterBackend, OrderingFilter]
     filterset_fields = [
         'promocode',
@@ -180,22 +313,40 @@ class OrderViewSet(ModelViewSet):
         'created_at',
         'user',
         'products',
+        'product_count',
+        'total_price',
+        'total_discounted_price',
     ]
 
 class LatestProductsFeed(Feed):
     title = 'Latest products feed'
     description = 'Updates on changes and addition latest products'
 
-    def link(self):
-        return reverse('shopapp:products_list')
+    def __init__(self):
+        markcoroutinefunction(self)
+
+    async def __call__(self, request: HttpRequest, *args, **kwargs) -> HttpResponse:
+        # Feed.__call__ with the items read by the async ORM and passed to get_feed() as its object;
+        # they stay local because one feed instance serves every request
+        products = [product async for product in self.get_queryset()]
+        feedgen = self.get_feed(products, request)
+        response = HttpResponse(content_type=feedgen.content_type)
+        feedgen.write(response, 'utf-8')
+        return response
 
-    def items(self):
+    def get_queryset(self):
         return (
             Product.objects
             .filter(created_at__isnull=False)
             .order_by('-created_at')[:5]
         )
 
+    def link(self):
+        return reverse('shopapp:products_list')
+
+    def items(self, products):
+        return products
+
     def item_title(self, item: Product):
         return item.name
 
@@ -206,12 +357,11 @@ class UserExportView(LoginRequiredMixin, View):
 
     def get(self, request, user_id):
         user = get_object_or_404(User, id=user_id)
-        cache_key = f'user_{user_id}_orders_export'
-        data = cache.get(cache_key)
-        if data is None:
-            orders = Order.objects.filter(user=user).order_by('pk')
-            data = serializers.serialize('json', orders)
-        cache.set(cache_key, data, 200)
+        data = get_or_build(
+            user_orders_export_key(user.pk),
+            lambda: serializers.serialize('json', Order.objects.filter(user=user).order_by('pk')),
+            timeout=200,
+        )
         return HttpResponse(data, content_type='application/json')
 
     def dispatch(self, request, *args, **kwargs):
@@ -221,14 +371,17 @@ class UserExportView(LoginRequiredMixin, View):
 
 class UserOrdersListView(LoginRequiredMixin, ListView):
     template_name = 'shopapp/user-order-list.html'
+    paginate_by = 20
     def get_queryset(self):
         user_id = self.kwargs['user_id']
         self.owner = get_object_or_404(User, id=user_id)
-        return Order.objects.filter(user=self.owner)
+        # the page only links to the orders
+        return Order.objects.filter(user=self.owner).only('pk').order_by('-created_at', '-pk')
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context["owner"] = self.owner
+        context["orders_version"] = get_user_orders_version(self.owner.pk)
         return context
 
     def dispatch(self, request, *args, **kwargs):